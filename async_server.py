@@ -0,0 +1,137 @@
+import asyncio
+import contextlib
+import functools
+import json
+import re
+import urllib.parse
+import encoder
+from hypercorn.app_wrappers import WSGIWrapper
+
+JOB_AUDIO = re.compile(r"/jobs/(?P<job_id>[^/]+)/audio")
+
+
+# The ASGI app of --server=asyncio. Downloads that need no ffmpeg, from
+# /read?getaudio as well as from /jobs/<id>/audio, are streamed from the event
+# loop, so any number of them can be going on without a thread each.
+# Everything else is handed to the Flask app on the loop's executor. The WSGI
+# wrapper is hypercorn's, which is why its version is pinned
+class AsyncApp:
+    def __init__(self, app, max_body_size):
+        self.app = app
+        self.wsgi = WSGIWrapper(app.flask, max_body_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+
+        if scope["type"] == "http":
+            query = urllib.parse.parse_qs(
+                scope["query_string"].decode("latin-1"), keep_blank_values=True
+            )
+            fmt = query.get("format", ["raw"])[-1]
+            streamed = fmt in encoder.FORMATS and not encoder.needs_ffmpeg(fmt)
+            match = JOB_AUDIO.fullmatch(scope["path"])
+
+            if (
+                streamed
+                and scope["path"] == "/read"
+                and "getaudio" in query
+                and "detach" not in query
+            ):
+                await self.read(scope, receive, send, fmt)
+                return
+            if streamed and match is not None and scope["method"] == "GET":
+                await self.job_audio(match.group("job_id"), fmt, receive, send)
+                return
+
+        await self.wsgi_app(scope, receive, send)
+
+    async def wsgi_app(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+
+        def call_soon(func, *args):
+            return asyncio.run_coroutine_threadsafe(func(*args), loop).result()
+
+        await self.wsgi(
+            scope,
+            receive,
+            send,
+            functools.partial(loop.run_in_executor, None),
+            call_soon,
+        )
+
+    async def read(self, scope, receive, send, fmt):
+        # The Flask app queues it as a detached download, whose audio is then
+        # streamed from here. Its other answers, errors included, are passed on
+        scope = dict(scope, query_string=scope["query_string"] + b"&detach")
+        messages = []
+
+        async def capture(message):
+            messages.append(message)
+
+        await self.wsgi_app(scope, receive, capture)
+        start = messages[0]
+        queued = start["status"] == 200 and (
+            (b"content-type", b"application/json") in start["headers"]
+        )
+        if queued:
+            body = b"".join(message.get("body", b"") for message in messages[1:])
+            job_id = json.loads(body).get("job")
+            if job_id is not None:
+                await self.job_audio(job_id, fmt, receive, send)
+                return
+
+        for message in messages:
+            await send(message)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def job_audio(self, job_id, fmt, receive, send):
+        audio = self.app.tts.ajob_audio(job_id)
+        if audio is None:
+            body = b"No such download, or it's already being fetched"
+            await send({"type": "http.response.start", "status": 404, "headers": []})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", encoder.content_type(fmt).encode())],
+            }
+        )
+
+        async def stream():
+            async with contextlib.aclosing(audio):
+                if fmt == "wav":
+                    header = encoder.wav_header(self.app.parsed.piper_rate)
+                    await send(
+                        {"type": "http.response.body", "body": header, "more_body": True}
+                    )
+                async for block in audio:
+                    await send(
+                        {"type": "http.response.body", "body": block, "more_body": True}
+                    )
+            await send({"type": "http.response.body", "body": b""})
+
+        async def disconnected():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        # A client that goes away cancels the stream, and with it the job
+        tasks = [asyncio.create_task(stream()), asyncio.create_task(disconnected())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,165 @@
+import collections
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# Synthesized audio keyed by everything that affects it. Recently used entries
+# are kept in memory and, if a directory is given, every entry is also written
+# to disk. Both tiers evict the least recently used entries past their capacity
+class AudioCache:
+    def __init__(self, parsed):
+        self.parsed = parsed
+        self.lock = threading.Lock()
+
+        self.memory = collections.OrderedDict()
+        self.memory_bytes = 0
+        self.memory_capacity = int(self.parsed.piper_cache_memory * 1024 * 1024)
+
+        self.disk = collections.OrderedDict()
+        self.disk_bytes = 0
+        self.disk_capacity = int(self.parsed.piper_cache_size * 1024 * 1024)
+        self.directory = self.parsed.piper_cache_dir
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_served = 0
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.load_disk_index()
+
+        # Everything but the text is the same for every entry
+        self.prefix = "\0".join(
+            [
+                os.path.abspath(self.parsed.piper_model or ""),
+                os.path.abspath(self.parsed.piper_model_config or ""),
+                f"{self.parsed.piper_sentence_silence}",
+                f"{self.parsed.piper_rate}",
+            ]
+        )
+
+    def load_disk_index(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".pcm"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_bytes += size
+        self.evict_disk()
+
+    def key(self, text):
+        text = " ".join(text.split())
+        return hashlib.sha256(f"{self.prefix}\0{text}".encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.pcm")
+
+    def get(self, key):
+        with self.lock:
+            audio = self.memory.get(key)
+            if audio is not None:
+                self.memory.move_to_end(key)
+                if key in self.disk:
+                    self.disk.move_to_end(key)
+                self.hits += 1
+                self.bytes_served += len(audio)
+                return audio
+
+            if key not in self.disk:
+                self.misses += 1
+                return None
+
+            try:
+                with open(self.path(key), "rb") as f:
+                    audio = f.read()
+                os.utime(self.path(key))
+            except OSError as e:
+                logger.warning("Dropping unreadable cache entry %s: %s", key, repr(e))
+                self.disk_bytes -= self.disk.pop(key)
+                self.misses += 1
+                return None
+
+            self.disk.move_to_end(key)
+            self.hits += 1
+            self.disk_hits += 1
+            self.bytes_served += len(audio)
+            self.put_memory(key, audio)
+            return audio
+
+    def contains(self, key):
+        # Without counting as a lookup
+        with self.lock:
+            return key in self.memory or key in self.disk
+
+    def put(self, key, audio):
+        with self.lock:
+            self.put_memory(key, audio)
+
+            if self.directory is None or key in self.disk:
+                return
+            if len(audio) > self.disk_capacity:
+                return
+
+            try:
+                fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(audio)
+                os.replace(tmp, self.path(key))
+            except OSError as e:
+                logger.warning("Failed to write cache entry %s: %s", key, repr(e))
+                return
+
+            self.disk[key] = len(audio)
+            self.disk_bytes += len(audio)
+            self.evict_disk()
+
+    def put_memory(self, key, audio):
+        if len(audio) > self.memory_capacity:
+            return
+
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+
+        self.memory[key] = audio
+        self.memory_bytes += len(audio)
+        while self.memory_bytes > self.memory_capacity:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+            self.evictions += 1
+
+    def evict_disk(self):
+        while self.disk_bytes > self.disk_capacity:
+            key, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def status(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups > 0 else None,
+                "evictions": self.evictions,
+                "bytes_served": self.bytes_served,
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk_bytes,
+            }
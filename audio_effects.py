@@ -0,0 +1,148 @@
+import array
+import math
+import operator
+import sys
+
+
+def to_samples(audio):
+    samples = array.array("h")
+    samples.frombytes(audio)
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples
+
+
+def to_bytes(samples):
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples.tobytes()
+
+
+# Volume applied to the stream as it's written. A change is ramped in over
+# one block so that it doesn't click
+class Gain:
+    def __init__(self):
+        self.volume = 1.0
+
+    def apply(self, samples, volume):
+        # Takes s16 samples as an array or a list of floats, returns s16le
+        start = self.volume
+        self.volume = volume
+        if start == volume == 1.0 and isinstance(samples, array.array):
+            return to_bytes(samples)
+
+        step = (volume - start) / max(1, len(samples))
+        out = array.array(
+            "h",
+            (
+                max(-32768, min(32767, round(s * (start + step * i))))
+                for i, s in enumerate(samples)
+            ),
+        )
+        return to_bytes(out)
+
+
+# Changes the tempo of a mono stream without changing its pitch, using
+# WSOLA: frames are taken from the input at speed times the output hop, each
+# shifted within a small window to where it best continues the previous one,
+# and overlap-added with a Hann window. The speed can change between calls.
+# Holds back about a frame and a half of input
+class TimeStretch:
+    def __init__(self, rate, frame_duration=0.02, search_duration=0.005):
+        self.half = int(rate * frame_duration / 2)
+        self.size = self.half * 2
+        self.search = int(rate * search_duration)
+        self.window = [
+            0.5 - 0.5 * math.cos(2 * math.pi * i / self.size) for i in range(self.size)
+        ]
+        self.speed = 1.0
+        self.reset()
+
+    def reset(self):
+        self.input = []
+        self.position = 0.0
+        self.target = None
+        self.overlap = []
+
+    def active(self):
+        return len(self.input) > 0 or self.target is not None
+
+    def process(self, samples, speed):
+        self.speed = speed
+        self.input.extend(samples)
+        hop = self.half * speed
+        out = []
+        while True:
+            nominal = int(self.position)
+            if nominal + self.search + self.size + self.half > len(self.input):
+                break
+
+            # At normal speed consecutive frames line up exactly and the
+            # windows sum to one, so the input comes out unchanged
+            if self.target is None or hop == self.half:
+                start = nominal
+            else:
+                start = self.best(nominal)
+            frame = self.input[start : start + self.size]
+            window = self.window
+            half = self.half
+
+            if self.target is None:
+                # Continue straight from whatever was played before
+                out.extend(frame[:half])
+            else:
+                out.extend(
+                    self.overlap[i] + window[i] * frame[i] for i in range(half)
+                )
+            self.overlap = [window[i] * frame[i] for i in range(half, self.size)]
+            self.target = self.input[start + half : start + half + self.size]
+
+            self.position += hop
+            drop = int(self.position) - self.search
+            if drop > 0:
+                del self.input[:drop]
+                self.position -= drop
+
+        return out
+
+    def best(self, nominal):
+        # Coarse search over decimated samples, then refine around the best
+        target = self.target
+        coarse = target[::8]
+        low = max(-self.search, -nominal)
+        candidates = range(low, self.search + 1, 4)
+        best = max(
+            candidates,
+            key=lambda d: sum(
+                map(
+                    operator.mul,
+                    coarse,
+                    self.input[nominal + d : nominal + d + self.size : 8],
+                )
+            ),
+        )
+
+        fine = target[::4]
+        candidates = range(max(low, best - 3), min(self.search, best + 3) + 1)
+        best = max(
+            candidates,
+            key=lambda d: sum(
+                map(
+                    operator.mul,
+                    fine,
+                    self.input[nominal + d : nominal + d + self.size : 4],
+                )
+            ),
+        )
+        return nominal + best
+
+    def flush(self):
+        # Everything that's been held back, stretched, and back to pass-through
+        if not self.active():
+            return []
+
+        remaining = int((len(self.input) - self.position) / self.speed)
+        out = self.process([0.0] * (self.search + self.size + self.half), self.speed)
+        out.extend(self.overlap)
+        self.reset()
+        return out[:remaining]
@@ -0,0 +1,143 @@
+import logging
+import metrics
+import subprocess
+import sys
+import threading
+import time
+from audio_effects import Gain, TimeStretch, to_samples
+from locked import Locked
+
+logger = logging.getLogger(__name__)
+
+
+# A single ffplay process which is fed s16le mono audio for as long as the
+# server runs. Writes are paced to real time so that only a small lead is ever
+# buffered inside ffplay, which lets pause and skip act on our side of the pipe.
+# Speed and volume are applied here too, so that changing them takes effect
+# on the next slice instead of restarting ffplay
+class PcmSink:
+    def __init__(self, parsed, ffplay_path, lead=0.1, slice_duration=0.05):
+        self.parsed = parsed
+        self.ffplay_path = ffplay_path
+        self.lead = lead
+        self.process = Locked(None)
+        self.write_lock = threading.Lock()
+        self.bytes_per_second = self.parsed.piper_rate * 2
+        self.slice_size = int(self.parsed.piper_rate * slice_duration) * 2
+
+        self.stretch = TimeStretch(self.parsed.piper_rate)
+        self.gain = Gain()
+        self.play_until = 0.0
+        self.written = 0
+        self.starts = 0
+
+    def start(self):
+        with self.process.lock:
+            process = self.process.data
+            if process is not None and process.poll() is None:
+                return
+
+            started = time.monotonic()
+            try:
+                self.process.data = subprocess.Popen(
+                    [
+                        self.ffplay_path,
+                        "-hide_banner",
+                        "-loglevel",
+                        "panic",
+                        "-nostats",
+                        "-autoexit",
+                        "-nodisp",
+                        "-f",
+                        "s16le",
+                        "-ar",
+                        f"{self.parsed.piper_rate}",
+                        "-ac",
+                        "1",
+                        "-",
+                    ],
+                    stdin=subprocess.PIPE,
+                )
+            except OSError as e:
+                logger.error("Failed to start ffplay: %s", repr(e))
+                self.process.data = None
+                return
+
+            metrics.PLAYER_START.observe(time.monotonic() - started)
+            self.play_until = 0.0
+            self.starts += 1
+
+    def stop(self):
+        with self.process.lock:
+            if self.process.data is not None:
+                self.process.data.terminate()
+                self.process.data = None
+
+    def write(self, audio):
+        # Should be called with at most slice_size bytes at a time, otherwise
+        # the lead grows by the size of the write
+        with self.write_lock:
+            speed = self.parsed.speed
+            if (
+                speed == 1.0
+                and not self.stretch.active()
+                and self.gain.volume == self.parsed.volume == 1.0
+                and sys.byteorder == "little"
+            ):
+                # Nothing to do to it, so it's written as it is
+                return self.send(audio)
+            samples = to_samples(audio)
+            if speed != 1.0 or self.stretch.active():
+                samples = self.stretch.process(samples, speed)
+            return self.send(self.gain.apply(samples, self.parsed.volume))
+
+    def flush(self):
+        # Plays what the time stretch is holding back. For the end of the audio
+        with self.write_lock:
+            samples = self.stretch.flush()
+            if len(samples) > 0:
+                self.send(self.gain.apply(samples, self.parsed.volume))
+
+    def discard(self):
+        # Drops what the time stretch is holding back. For skips
+        with self.write_lock:
+            self.stretch.reset()
+
+    def send(self, audio):
+        if len(audio) == 0:
+            return True
+
+        self.start()
+        process = self.process.get()
+        if process is None:
+            return False
+
+        wait = self.play_until - time.monotonic() - self.lead
+        if wait > 0:
+            time.sleep(wait)
+
+        try:
+            process.stdin.write(audio)
+            process.stdin.flush()
+        except (OSError, ValueError) as e:
+            logger.warning("ffplay went away, restarting it: %s", repr(e))
+            self.stop()
+            return False
+
+        duration = len(audio) / self.bytes_per_second
+        self.play_until = max(self.play_until, time.monotonic()) + duration
+        self.written += len(audio)
+        return True
+
+    def buffered(self):
+        return max(0.0, self.play_until - time.monotonic())
+
+    def status(self):
+        process = self.process.get()
+        return {
+            "pid?": None if process is None else process.pid,
+            "starts": self.starts,
+            "written": self.written,
+            "stretching": self.stretch.active(),
+            "buffered()": self.buffered(),
+        }
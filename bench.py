@@ -0,0 +1,927 @@
+import argparse
+import array
+import asyncio
+import http.client
+import importlib.util
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from audio_sink import PcmSink
+from locked import Locked
+from main import SERVERS, App, make_parser
+from piper_backend import Piper
+from piper_worker import PiperModuleWorker, PiperWorker, WorkerCancelled
+from normalize import RULES, Normalizer, transliterate
+from unidecode import unidecode
+from segment import split_sentences
+
+logger = logging.getLogger(__name__)
+
+# A bit of everything the segmenter has to get right, repeated to build large
+# documents
+PARAGRAPH = (
+    "Dr. Smith paid $3.50 at example.com/a.b on Jan. 5, and then he left! "
+    "Did he? Yes; he did... but only after J. R. R. Tolkien had written to him, "
+    "e.g. about The Hobbit, etc. See Fig. 3 and No. 5 for the details.\n"
+    "It was a dark and stormy night; the rain fell in torrents, except at "
+    "occasional intervals, when it was checked by a violent gust of wind which "
+    "swept up the streets (for it is in London that our scene lies), rattling "
+    "along the housetops, and fiercely agitating the scanty flame of the lamps "
+    "that struggled against the darkness.\n\n"
+)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "median": statistics.median(samples),
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "min": samples[0],
+        "max": samples[-1],
+    }
+
+
+def bench_workers(parsed):
+    # Per-chunk cost of every way we can run piper. A short utterance is
+    # dominated by the per-request overhead, a long one by inference
+    modes = {}
+    piper_path = shutil.which("piper-tts")
+    has_module = importlib.util.find_spec("piper") is not None
+    if piper_path is not None:
+        modes["cpp"] = lambda: PiperWorker(parsed, piper_path, False)
+    if has_module:
+        modes["python"] = lambda: PiperWorker(parsed, None, True)
+        modes["in_process"] = lambda: PiperModuleWorker(parsed)
+
+    results = {}
+    for name, make in modes.items():
+        if parsed.mode and name not in parsed.mode:
+            continue
+
+        worker = make()
+        began = time.monotonic()
+        worker.start()
+        worker.synthesize(parsed.short)
+        cold = time.monotonic() - began
+
+        result = {"cold_start": cold}
+        for label, text in (("short", parsed.short), ("long", parsed.long)):
+            samples = []
+            audio = b""
+            for _ in range(parsed.runs):
+                began = time.monotonic()
+                audio = worker.synthesize(text)
+                samples.append(time.monotonic() - began)
+            result[label] = summarize(samples)
+            result[label]["audio_seconds"] = len(audio) / 2 / parsed.piper_rate
+            result[label]["rtf"] = result[label]["median"] / max(
+                result[label]["audio_seconds"], 1e-9
+            )
+        worker.stop()
+
+        results[name] = result
+        logger.info(
+            "%s: cold start %.3fs, short median %.4fs, long median %.4fs",
+            name,
+            cold,
+            result["short"]["median"],
+            result["long"]["median"],
+        )
+
+    return results
+
+
+def bench_segment(parsed):
+    # Time per character should stay flat as the documents grow
+    results = []
+    for size in parsed.sizes:
+        text = PARAGRAPH * max(1, int(size * 1024 * 1024 / len(PARAGRAPH)))
+        samples = []
+        chunks = []
+        for _ in range(parsed.runs):
+            began = time.monotonic()
+            chunks = split_sentences(text)
+            samples.append(time.monotonic() - began)
+
+        result = summarize(samples)
+        result["characters"] = len(text)
+        result["chunks"] = len(chunks)
+        result["mb_per_second"] = len(text) / result["median"] / 1024 / 1024
+        result["ns_per_character"] = result["median"] / len(text) * 1e9
+        results.append(result)
+        logger.info(
+            "%.2f MiB: %.3fs, %.1f MiB/s, %d chunks",
+            len(text) / 1024 / 1024,
+            result["median"],
+            result["mb_per_second"],
+            len(chunks),
+        )
+
+    return results
+
+
+def bench_normalize(parsed):
+    # MB/s of the /read normalization on plain ASCII, on text with accents
+    # and ignored characters, and on text with a lot of whitespace to clean up
+    normalizer = Normalizer(parsed.ignore_chars, parsed.rules)
+    text = PARAGRAPH * max(1, int(parsed.size * 1024 * 1024 / len(PARAGRAPH)))
+    documents = {
+        "ascii": text,
+        "unicode": text.replace("e", "é").replace("c", "ç*"),
+        "whitespace": text.replace(" ", " \t ").replace("\n", " \n  "),
+    }
+
+    results = {}
+    for name, document in documents.items():
+        samples = []
+        for _ in range(parsed.runs):
+            began = time.monotonic()
+            normalizer.normalize(document)
+            samples.append(time.monotonic() - began)
+
+        result = summarize(samples)
+        result["characters"] = len(document)
+        result["mb_per_second"] = len(document) / result["median"] / 1024 / 1024
+        results[name] = result
+        logger.info("%s: %.1f MiB/s", name, result["mb_per_second"])
+
+    return results
+
+
+# Samples of the scripts people read, on top of the random ones below
+SCRIPTS = [
+    "Café naïve façade, jalapeño, smörgåsbord, Ærøskøbing, Łódź, Dvořák.",
+    "Съешь же ещё этих мягких французских булок, да выпей чаю.",
+    "Ξεσκεπάζω την ψυχοφθόρα βδελυγμία.",
+    "北京欢迎你。東京タワーへようこそ！서울에 오신 것을 환영합니다.",
+    "مرحبا بالعالم. שלום עולם. नमस्ते दुनिया. สวัสดีชาวโลก",
+    "“Smart quotes” — dashes – ellipses… ½ ¼ ℃ ™ © ® § ¶ • ‰ € £ ¥",
+    "Emoji 😀🎉 and math 𝔸𝕓𝕔 ∑∫√∞≠≤≥, plus \u200b\ufeff zero widths.",
+]
+
+
+def random_char(rng, top):
+    # Anything but surrogates, which can't come out of UTF-8 decoding
+    while True:
+        code = rng.randint(0x80, top)
+        if not 0xD800 <= code <= 0xDFFF:
+            return chr(code)
+
+
+def random_text(rng, length):
+    # Mostly ASCII with runs of characters from all over the BMP and beyond,
+    # to exercise the run boundaries and the memo
+    out = []
+    while len(out) < length:
+        if rng.random() < 0.7:
+            ascii = "abcdefghij KLMNO.,\n\t"
+            out.extend(rng.choice(ascii) for _ in range(rng.randint(1, 12)))
+        else:
+            top = rng.choice((0x250, 0x3000, 0xFFFF, 0x10FFFF))
+            out.extend(random_char(rng, top) for _ in range(rng.randint(1, 6)))
+    return "".join(out)
+
+
+def bench_transliterate(parsed):
+    # Differential check of the transliteration fast path against unidecode on
+    # a corpus, then the speed of both on mostly ASCII text
+    rng = random.Random(parsed.seed)
+    corpus = SCRIPTS + [
+        random_text(rng, rng.randint(1, 400)) for _ in range(parsed.samples)
+    ]
+    # Every code point but the surrogates, in blocks
+    corpus += [
+        "".join(
+            chr(c)
+            for c in range(start, min(start + 256, 0x110000))
+            if not 0xD800 <= c <= 0xDFFF
+        )
+        for start in range(0x80, 0x110000, 256)
+    ]
+
+    mismatches = []
+    for text in corpus:
+        # The same text twice, so the second pass comes out of the memo
+        for _ in range(2):
+            if transliterate(text) != unidecode(text):
+                mismatches.append(text)
+    logger.info("%d texts checked, %d mismatches", len(corpus), len(mismatches))
+
+    text = PARAGRAPH * max(1, int(parsed.size * 1024 * 1024 / len(PARAGRAPH)))
+    text = text.replace("Dr.", "Dr. Müller").replace("night", "nuit blanche à Paris")
+    speed = {}
+    for name, function in (("unidecode", unidecode), ("transliterate", transliterate)):
+        samples = []
+        for _ in range(parsed.runs):
+            began = time.monotonic()
+            function(text)
+            samples.append(time.monotonic() - began)
+        speed[name] = summarize(samples)
+        speed[name]["mb_per_second"] = len(text) / speed[name]["median"] / 1024 / 1024
+        logger.info("%s: %.1f MiB/s", name, speed[name]["mb_per_second"])
+
+    if len(mismatches) > 0:
+        logger.error("Transliteration differs from unidecode for %r", mismatches[0])
+    return {
+        "texts": len(corpus),
+        "mismatches": [repr(text[:80]) for text in mismatches[:10]],
+        "speed": speed,
+        # Exits non-zero, the fast path has to match unidecode exactly
+        "failed": len(mismatches) > 0,
+    }
+
+
+# Stands in for a piper worker. Synthesizes a tone of a fixed length per
+# character in blocks, taking rtf seconds per second of audio
+class FakeWorker:
+    def __init__(self, parsed):
+        self.parsed = parsed
+        self.request_lock = threading.Lock()
+        self.cancelled = Locked(False)
+        self.uses = 0
+
+        rate = self.parsed.piper_rate
+        self.bytes_per_second = rate * 2
+        self.block_size = int(rate * parsed.block) * 2
+        tone = array.array(
+            "h",
+            (
+                int(8000 * math.sin(2 * math.pi * 220 * i / rate))
+                for i in range(self.block_size // 2)
+            ),
+        )
+        self.block = tone.tobytes()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def cancel(self):
+        if self.request_lock.locked():
+            self.cancelled.set(True)
+
+    def stream(self, text):
+        with self.request_lock:
+            self.cancelled.set(False)
+            seconds = len(text) / self.parsed.chars_per_second
+            size = int(seconds * self.parsed.piper_rate) * 2
+            while size > 0:
+                block = self.block[: min(size, len(self.block))]
+                time.sleep(len(block) / self.bytes_per_second * self.parsed.rtf)
+                if self.cancelled.get():
+                    raise WorkerCancelled("Cancelled")
+                size -= len(block)
+                yield block
+            self.uses += 1
+
+    def synthesize(self, text):
+        return b"".join(self.stream(text))
+
+    def status(self):
+        return {"fake": True, "uses": self.uses, "busy": self.request_lock.locked()}
+
+
+# Throws the audio away instead of playing it, paced to real time or not
+class NullSink(PcmSink):
+    def __init__(self, parsed, realtime):
+        super().__init__(parsed, None)
+        self.realtime = realtime
+        self.last_write = None
+
+    def start(self):
+        pass
+
+    def send(self, audio):
+        if len(audio) == 0:
+            return True
+
+        if self.realtime:
+            wait = self.play_until - time.monotonic() - self.lead
+            if wait > 0:
+                time.sleep(wait)
+            duration = len(audio) / self.bytes_per_second
+            self.play_until = max(self.play_until, time.monotonic()) + duration
+
+        self.written += len(audio)
+        self.last_write = time.monotonic()
+        return True
+
+
+class BenchPiper(Piper):
+    def find_piper(self):
+        return True
+
+    def make_sink(self):
+        return NullSink(self.parsed, self.parsed.realtime)
+
+    def make_worker(self):
+        return FakeWorker(self.parsed)
+
+
+class BenchApp(App):
+    def find_paste_commands(self):
+        # Only ever POSTed to
+        self.paste_command = None
+        self.watch_command = None
+
+    def make_tts(self):
+        return BenchPiper(self.parsed)
+
+
+def fake_app(parsed, args):
+    # An App on the fake synthesizer and the null sink, with the server's
+    # defaults but for args. The cache is off so that every run synthesizes
+    app_parsed = make_parser().parse_args(
+        [
+            "--notify=off",
+            "--piper-cache-memory=0",
+            f"--piper-lookahead={parsed.lookahead}",
+            f"--piper-rate={parsed.piper_rate}",
+        ]
+        + args
+    )
+    for name in ("rtf", "chars_per_second", "block", "realtime"):
+        setattr(app_parsed, name, getattr(parsed, name))
+    return BenchApp(app_parsed)
+
+
+def document(size):
+    return (PARAGRAPH * (size // len(PARAGRAPH) + 1))[:size]
+
+
+def bench_pipeline(parsed):
+    # /read through to the sink with a fake synthesizer, across text sizes,
+    # skip granularities and worker counts
+    results = []
+    for size in parsed.sizes:
+        text = document(size)
+        for chunking in parsed.chunking:
+            for workers in parsed.workers:
+                args = [f"--piper-workers={workers}"]
+                if chunking == "sentence":
+                    args.append("--piper-one-sentence")
+
+                result = {
+                    "characters": len(text),
+                    "chunking": chunking,
+                    "workers": workers,
+                    **run_pipeline(fake_app(parsed, args), text, parsed.runs),
+                }
+                results.append(result)
+                logger.info(
+                    "%d chars, %s, %d workers: ttfa %.4fs, %.0f chars/s, "
+                    "peak %.1f MiB, reset %.4fs, ttfa during a download %.4fs",
+                    len(text),
+                    chunking,
+                    workers,
+                    result["ttfa"]["median"],
+                    result["chars_per_second"]["median"],
+                    result["peak_mib"],
+                    result["reset"]["median"],
+                    result["ttfa_during_download"]["median"],
+                )
+
+    return results
+
+
+def run_pipeline(app, text, runs):
+    client = app.flask.test_client()
+    piper = app.tts
+    ttfa = []
+    throughput = []
+    resets = []
+    silences = []
+    contended = []
+    peak = 0
+
+    for _ in range(runs):
+        tracemalloc.start()
+        began = time.monotonic()
+        job = read(client, piper, text)
+        while not job.finished() or job.position < job.generated_bytes:
+            time.sleep(0.001)
+        elapsed = time.monotonic() - began
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        ttfa.append(job.ttfa)
+        throughput.append(len(text) / elapsed)
+
+        # Reset in the middle of reading, and wait for the audio to stop
+        job = read(client, piper, text)
+        while job.ttfa is None and not job.finished():
+            time.sleep(0.001)
+        began = time.monotonic()
+        client.get("/reset")
+        resets.append(time.monotonic() - began)
+        while piper.play_queue.qsize() > 0 or any(
+            worker.request_lock.locked() for worker in piper.workers
+        ):
+            time.sleep(0.001)
+        time.sleep(0.05)
+        silences.append(max(0.0, (piper.sink.last_write or began) - began))
+
+        # A short reading while text is being downloaded as fast as possible
+        job_id = client.post(
+            "/read?getaudio&detach", data=text.encode(), content_type="text/plain"
+        ).json["job"]
+        downloader = threading.Thread(
+            target=lambda: sum(len(block) for block in piper.job_audio(job_id))
+        )
+        downloader.start()
+        time.sleep(0.1)
+        job = read(client, piper, document(200))
+        while job.ttfa is None and not job.finished():
+            time.sleep(0.001)
+        contended.append(job.ttfa)
+        client.get("/reset")
+        downloader.join()
+
+    ring = piper.play_queue.status()["ring.status()"]
+    return {
+        "ttfa": summarize(ttfa),
+        "chars_per_second": summarize(throughput),
+        "peak_mib": peak / 1024 / 1024,
+        "reset": summarize(resets),
+        "audio_stopped": summarize(silences),
+        "ttfa_during_download": summarize(contended),
+        "ring_peak_mib": ring["peak"] / 1024 / 1024,
+        "ring_overruns": ring["overruns"],
+    }
+
+
+def read(client, piper, text):
+    response = client.post("/read", data=text.encode(), content_type="text/plain")
+    return piper.jobs[response.json["job"]]
+
+
+def serve(parsed):
+    # The server on the fake synthesizer, for load tests
+    app = fake_app(
+        parsed,
+        [
+            f"--server={parsed.server}",
+            f"--port={parsed.port}",
+            f"--server-threads={parsed.server_threads}",
+            f"--piper-workers={parsed.workers}",
+        ],
+    )
+    app.run()
+
+
+def bench_server(parsed):
+    # Latency of the control endpoints while downloads are streaming, and how
+    # long the server takes to shut down, for every server
+    results = {}
+    for server in parsed.servers:
+        results[server] = load_test(parsed, server)
+        logger.info(
+            "%s: %s, shut down in %.3fs",
+            server,
+            ", ".join(
+                f"{path} p95 {result['p95'] * 1000:.3f}ms"
+                for path, result in results[server]["control"].items()
+            ),
+            results[server]["shutdown_seconds"],
+        )
+    return results
+
+
+def load_test(parsed, server):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    command = [sys.executable, os.path.abspath(__file__), "serve"]
+    command += [
+        f"--server={server}",
+        f"--port={port}",
+        f"--server-threads={parsed.server_threads}",
+        f"--workers={parsed.workers}",
+        f"--rtf={parsed.rtf}",
+        f"--chars-per-second={parsed.chars_per_second}",
+        f"--block={parsed.block}",
+        f"--lookahead={parsed.lookahead}",
+        f"--piper-rate={parsed.piper_rate}",
+    ]
+    process = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_server(port)
+
+        text = document(parsed.size).encode()
+        streamed = []
+        downloads = [
+            threading.Thread(
+                target=download,
+                args=(port, text, parsed.detach, streamed),
+                daemon=True,
+            )
+            for _ in range(parsed.downloads)
+        ]
+        for thread in downloads:
+            thread.start()
+        # Let the downloads get going
+        time.sleep(0.5)
+
+        control = {}
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        for path in ("/pause", "/toggle", "/status"):
+            samples = []
+            for _ in range(parsed.requests):
+                began = time.monotonic()
+                connection.request("GET", path)
+                connection.getresponse().read()
+                samples.append(time.monotonic() - began)
+            control[path] = summarize(samples)
+        connection.close()
+        streaming = sum(thread.is_alive() for thread in downloads)
+
+        # With the downloads still streaming
+        began = time.monotonic()
+        process.send_signal(signal.SIGTERM)
+        code = process.wait(timeout=30)
+        shutdown = time.monotonic() - began
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+    for thread in downloads:
+        thread.join(timeout=5)
+
+    return {
+        "control": control,
+        "downloads_streaming_throughout": streaming,
+        "downloaded_bytes": sum(streamed),
+        "shutdown_seconds": shutdown,
+        "exit_code": code,
+    }
+
+
+def wait_for_server(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/status")
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def download(port, text, detach, streamed):
+    # Until the audio ends or the server goes away
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    size = 0
+    try:
+        path = "/read?getaudio&detach" if detach else "/read?getaudio"
+        connection.request(
+            "POST", path, body=text, headers={"Content-Type": "text/plain"}
+        )
+        response = connection.getresponse()
+        if detach:
+            job_id = json.loads(response.read())["job"]
+            connection.request("GET", f"/jobs/{job_id}/audio?format=wav")
+            response = connection.getresponse()
+        while True:
+            block = response.read1(65536)
+            if len(block) == 0:
+                break
+            size += len(block)
+    except (OSError, http.client.HTTPException):
+        pass
+    finally:
+        connection.close()
+        streamed.append(size)
+
+
+def bench_fanout(parsed):
+    # Many downloads at once, streamed with a thread each through job_audio()
+    # and from a single event loop through ajob_audio()
+    text = document(parsed.size)
+    results = {}
+    for mode in ("threads", "asyncio"):
+        app = fake_app(parsed, [f"--piper-workers={parsed.workers}"])
+        client = app.flask.test_client()
+        job_ids = [
+            client.post(
+                "/read?getaudio&detach", data=text.encode(), content_type="text/plain"
+            ).json["job"]
+            for _ in range(parsed.downloads)
+        ]
+
+        threads = threading.active_count()
+        cpu = time.process_time()
+        began = time.monotonic()
+        if mode == "threads":
+            sizes, peak = fanout_threads(app, job_ids)
+        else:
+            sizes, peak = asyncio.run(fanout_asyncio(app, job_ids))
+        elapsed = time.monotonic() - began
+
+        results[mode] = {
+            "downloads": len(job_ids),
+            "seconds": elapsed,
+            "cpu_seconds": time.process_time() - cpu,
+            "downloaded_bytes": sum(sizes),
+            "complete": sum(size > 0 for size in sizes),
+            "extra_threads": peak - threads,
+        }
+        app.tts.shutdown()
+        logger.info(
+            "%s: %d downloads in %.3fs, %.3f CPU s, %d extra threads",
+            mode,
+            len(job_ids),
+            elapsed,
+            results[mode]["cpu_seconds"],
+            results[mode]["extra_threads"],
+        )
+
+    return results
+
+
+def fanout_threads(app, job_ids):
+    sizes = []
+
+    def consume(job_id):
+        sizes.append(sum(len(block) for block in app.tts.job_audio(job_id)))
+
+    threads = [threading.Thread(target=consume, args=(job_id,)) for job_id in job_ids]
+    for thread in threads:
+        thread.start()
+    peak = threading.active_count()
+    for thread in threads:
+        thread.join()
+    return sizes, peak
+
+
+async def fanout_asyncio(app, job_ids):
+    async def consume(job_id):
+        size = 0
+        async for block in app.tts.ajob_audio(job_id):
+            size += len(block)
+        return size
+
+    tasks = [asyncio.create_task(consume(job_id)) for job_id in job_ids]
+    await asyncio.sleep(0)
+    peak = threading.active_count()
+    return await asyncio.gather(*tasks), peak
+
+
+def bench_idle(parsed):
+    # CPU the pipeline burns while nothing is being read
+    app = fake_app(parsed, [f"--piper-workers={parsed.workers}"])
+    client = app.flask.test_client()
+    # Start every thread up before measuring
+    read(client, app.tts, "Hello.")
+    time.sleep(1)
+
+    cpu = time.process_time()
+    began = time.monotonic()
+    time.sleep(parsed.seconds)
+    elapsed = time.monotonic() - began
+    result = {
+        "seconds": elapsed,
+        "cpu_seconds": time.process_time() - cpu,
+        "threads": threading.active_count(),
+    }
+    app.tts.shutdown()
+    logger.info(
+        "%.1f%% CPU idle with %d threads",
+        result["cpu_seconds"] / elapsed * 100,
+        result["threads"],
+    )
+    return result
+
+
+def add_fake_arguments(subparser, rtf=0.1):
+    subparser.add_argument(
+        "--rtf", type=float, default=rtf, help="Synthesis seconds per second of audio"
+    )
+    subparser.add_argument(
+        "--chars-per-second", type=float, default=15, help="Speech rate of the audio"
+    )
+    subparser.add_argument(
+        "--block",
+        type=float,
+        default=0.25,
+        help="Seconds of audio per synthesized block",
+    )
+    subparser.add_argument("--lookahead", type=float, default=15)
+    subparser.add_argument("--piper-rate", type=int, default=22050)
+    subparser.add_argument(
+        "--realtime",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Pace the sink to real time, as the audio would play",
+    )
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench")
+    parser.add_argument(
+        "--output", type=str, default=None, help="Write the results as JSON here"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    workers = subparsers.add_parser(
+        "workers", help="Per-chunk latency of the piper C++ binary, module and in-process paths"
+    )
+    workers.add_argument("--piper-model", type=str, required=True)
+    workers.add_argument("--piper-model-config", type=str, required=True)
+    workers.add_argument("--piper-rate", type=int, default=22050)
+    workers.add_argument("--piper-sentence-silence", type=float, default=0.0)
+    workers.add_argument("--runs", type=int, default=20)
+    workers.add_argument(
+        "--mode",
+        nargs="*",
+        choices=["cpp", "python", "in_process"],
+        help="Only benchmark these",
+    )
+    workers.add_argument("--short", type=str, default="Hi.")
+    workers.add_argument(
+        "--long",
+        type=str,
+        default="The quick brown fox jumps over the lazy dog while the band plays on, "
+        "and nobody in the crowded hall seems to notice the time.",
+    )
+    workers.set_defaults(run=bench_workers)
+
+    segment = subparsers.add_parser(
+        "segment", help="Sentence segmentation throughput on growing documents"
+    )
+    segment.add_argument(
+        "--sizes",
+        nargs="+",
+        type=float,
+        default=[0.25, 1, 4, 16],
+        help="Document sizes in MiB",
+    )
+    segment.add_argument("--runs", type=int, default=3)
+    segment.set_defaults(run=bench_segment)
+
+    normalize = subparsers.add_parser(
+        "normalize", help="Text normalization throughput in MB/s"
+    )
+    normalize.add_argument("--size", type=float, default=4, help="MiB per document")
+    normalize.add_argument("--runs", type=int, default=5)
+    normalize.add_argument("--ignore-chars", nargs="*", default=["*"])
+    normalize.add_argument("--rules", nargs="*", choices=list(RULES), default=[])
+    normalize.set_defaults(run=bench_normalize)
+
+    transliteration = subparsers.add_parser(
+        "transliterate",
+        help="Check the transliteration fast path against unidecode and time both",
+    )
+    transliteration.add_argument("--samples", type=int, default=2000)
+    transliteration.add_argument("--seed", type=int, default=0)
+    transliteration.add_argument("--size", type=float, default=4, help="MiB")
+    transliteration.add_argument("--runs", type=int, default=3)
+    transliteration.set_defaults(run=bench_transliterate)
+
+    pipeline = subparsers.add_parser(
+        "pipeline",
+        help="Time to first audio, throughput, memory and reset latency of /read "
+        "with a fake synthesizer and a null sink",
+    )
+    pipeline.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[200, 1000, 4000],
+        help="Characters of text per /read",
+    )
+    pipeline.add_argument(
+        "--chunking",
+        nargs="+",
+        choices=["whole", "sentence"],
+        default=["whole", "sentence"],
+        help="Skip the whole text or a sentence at a time, as --piper-one-sentence",
+    )
+    pipeline.add_argument("--workers", nargs="+", type=int, default=[1, 2])
+    # Fast enough for a default run to take a couple of minutes
+    add_fake_arguments(pipeline, rtf=0.02)
+    pipeline.add_argument("--runs", type=int, default=3)
+    pipeline.set_defaults(run=bench_pipeline)
+
+    server = subparsers.add_parser(
+        "server",
+        help="Latency of /pause, /toggle and /status while downloads are "
+        "streaming, on each server",
+    )
+    server.add_argument(
+        "--servers", nargs="+", choices=SERVERS, default=list(SERVERS)
+    )
+    server.add_argument("--server-threads", type=int, default=8)
+    server.add_argument("--workers", type=int, default=2)
+    server.add_argument(
+        "--downloads", type=int, default=4, help="Downloads streaming at a time"
+    )
+    server.add_argument(
+        "--size", type=int, default=20000, help="Characters per download"
+    )
+    server.add_argument(
+        "--requests", type=int, default=200, help="Requests to each endpoint"
+    )
+    server.add_argument(
+        "--detach",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Download from /jobs/<id>/audio as WAV instead of from /read",
+    )
+    add_fake_arguments(server)
+    server.set_defaults(run=bench_server)
+
+    fanout = subparsers.add_parser(
+        "fanout",
+        help="Many downloads at once, with a thread each and from an event loop",
+    )
+    fanout.add_argument("--downloads", type=int, default=64)
+    fanout.add_argument(
+        "--size", type=int, default=2000, help="Characters per download"
+    )
+    fanout.add_argument("--workers", type=int, default=2)
+    add_fake_arguments(fanout)
+    fanout.set_defaults(run=bench_fanout)
+
+    idle = subparsers.add_parser(
+        "idle", help="CPU used by the pipeline while nothing is being read"
+    )
+    idle.add_argument("--seconds", type=float, default=5)
+    idle.add_argument("--workers", type=int, default=2)
+    add_fake_arguments(idle)
+    idle.set_defaults(run=bench_idle)
+
+    fake_server = subparsers.add_parser(
+        "serve", help="Run the server on the fake synthesizer"
+    )
+    fake_server.add_argument("--server", choices=SERVERS, default="flask")
+    fake_server.add_argument("--port", type=int, default=5000)
+    fake_server.add_argument("--server-threads", type=int, default=8)
+    fake_server.add_argument("--workers", type=int, default=2)
+    add_fake_arguments(fake_server)
+    fake_server.set_defaults(run=serve)
+
+    parsed = parser.parse_args()
+    logging.basicConfig(encoding="utf-8", level=logging.INFO)
+    if parsed.command == "serve":
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        serve(parsed)
+        return
+
+    results = {
+        "command": parsed.command,
+        "time": time.time(),
+        "commit": commit(),
+        "python": sys.version.split()[0],
+        "arguments": {
+            name: value for name, value in vars(parsed).items() if name != "run"
+        },
+        "results": parsed.run(parsed),
+    }
+
+    out = json.dumps(results, indent=2)
+    if parsed.output is None:
+        print(out)
+    else:
+        with open(parsed.output, "w") as f:
+            f.write(out)
+
+    if isinstance(results["results"], dict) and results["results"].get("failed"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
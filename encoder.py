@@ -0,0 +1,119 @@
+import logging
+import struct
+import subprocess
+import threading
+
+logger = logging.getLogger(__name__)
+
+OPUS = ["-c:a", "libopus", "-b:a", "32k", "-ar", "48000", "-f", "ogg"]
+
+# Format: (Content-Type, ffmpeg output arguments). Formats without arguments
+# are produced in-process
+FORMATS = {
+    "raw": ("application/octet-stream", None),
+    "wav": ("audio/wav", None),
+    "flac": ("audio/flac", ["-c:a", "flac", "-f", "flac"]),
+    "opus": ("audio/ogg", OPUS),
+    "ogg": ("audio/ogg", OPUS),
+    "mp3": ("audio/mpeg", ["-c:a", "libmp3lame", "-q:a", "6", "-f", "mp3"]),
+}
+
+
+def content_type(fmt):
+    return FORMATS[fmt][0]
+
+
+def needs_ffmpeg(fmt):
+    return FORMATS[fmt][1] is not None
+
+
+def encode(pcm, fmt, rate, ffmpeg_path):
+    # Turns an iterable of s16le mono blocks into the encoded stream of fmt,
+    # yielding output as soon as the encoder produces it
+    if fmt == "raw":
+        return iter(pcm)
+    if fmt == "wav":
+        return encode_wav(pcm, rate)
+    return encode_ffmpeg(pcm, FORMATS[fmt][1], rate, ffmpeg_path)
+
+
+def encode_wav(pcm, rate):
+    yield wav_header(rate)
+    yield from pcm
+
+
+def wav_header(rate):
+    # The length isn't known up front, so claim the largest possible one the
+    # way streaming encoders do. Players stop at the end of the stream
+    size = 0xFFFFFFFF - 36
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        size + 36,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        1,
+        rate,
+        rate * 2,
+        2,
+        16,
+        b"data",
+        size,
+    )
+
+
+def encode_ffmpeg(pcm, output_args, rate, ffmpeg_path):
+    process = subprocess.Popen(
+        [
+            ffmpeg_path,
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-nostdin",
+            "-f",
+            "s16le",
+            "-ar",
+            f"{rate}",
+            "-ac",
+            "1",
+            "-i",
+            "pipe:0",
+        ]
+        + output_args
+        + ["pipe:1"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+
+    def feed():
+        try:
+            for block in pcm:
+                process.stdin.write(block)
+                process.stdin.flush()
+        except (OSError, ValueError):
+            pass
+        finally:
+            if hasattr(pcm, "close"):
+                pcm.close()
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    try:
+        while True:
+            out = process.stdout.read1(65536)
+            if len(out) == 0:
+                break
+            yield out
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        if process.returncode not in (0, -9):
+            logger.error("ffmpeg exited with %d while encoding", process.returncode)
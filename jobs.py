@@ -0,0 +1,193 @@
+import array
+import bisect
+import threading
+import time
+import uuid
+
+
+# A single /read request. Its sentences are synthesized into target, which is
+# either the shared play queue or a queue of its own for downloads
+class Job:
+    def __init__(self, text, sentences, target, download, started):
+        self.id = uuid.uuid4().hex[:12]
+        self.characters = len(text)
+        self.sentences = sentences
+        self.target = target
+        self.download = download
+        self.started = started
+        self.created = time.time()
+        self.chunk = 0
+
+        self.dispatched = 0
+        self.synthesized = 0
+        self.generated_bytes = 0
+        self.played_bytes = 0
+
+        # Where each synthesized sentence's audio ends, in bytes from the start
+        # of the job's audio. Sentences are synthesized in order, so this is
+        # sorted and the index of an offset's sentence is a bisect away
+        self.ends = array.array("Q")
+        # Bumped whenever the job is rewound, to tell stale audio apart
+        self.generation = 0
+        # Where playback was moved to. Audio before this offset, or of the
+        # sentences before this index, is dropped instead of played
+        self.resume = 0
+        self.resume_index = 0
+        self.position = 0
+        self.ttfa = None
+        self.claimed = False
+        self.cancelled = False
+        # When a download's audio was last fetched or the job was created, and
+        # whether its reader is waiting for more
+        self.touched = time.monotonic()
+        self.waiting = False
+        self.epoch = 0
+
+    def finished(self):
+        return self.cancelled or self.synthesized == len(self.sentences)
+
+    def sentence_at(self, offset):
+        return bisect.bisect_right(self.ends, offset)
+
+    def sentence_start(self, index):
+        return 0 if index == 0 else self.ends[index - 1]
+
+    def skipped(self, offset):
+        return offset < self.resume or self.sentence_at(offset) < self.resume_index
+
+    def forward(self, index, offset):
+        # Drop the audio up to offset, or up to sentence index if it hasn't
+        # been synthesized yet. Must be called with the scheduler's condition
+        # held
+        self.resume = max(self.resume, offset)
+        self.resume_index = max(self.resume_index, index)
+        self.position = max(self.position, offset)
+
+    def rewind(self, index, offset):
+        # Synthesize again from sentence index on, starting playback at offset
+        # within it. Must be called with the scheduler's condition held
+        self.generation += 1
+        self.dispatched = index
+        self.synthesized = index
+        del self.ends[index:]
+        self.generated_bytes = self.sentence_start(index)
+        self.resume = offset
+        self.resume_index = index
+        self.position = offset
+
+    def state(self):
+        if self.cancelled:
+            return "cancelled"
+        if self.synthesized == len(self.sentences):
+            return "done"
+        if self.dispatched == 0:
+            return "queued"
+        return "running"
+
+    def status(self, bytes_per_second):
+        return {
+            "id": self.id,
+            "state": self.state(),
+            "download": self.download,
+            "characters": self.characters,
+            "sentences": len(self.sentences),
+            "dispatched": self.dispatched,
+            "synthesized": self.synthesized,
+            "generated_seconds": self.generated_bytes / bytes_per_second,
+            "played_seconds": self.played_bytes / bytes_per_second,
+            "position_seconds": self.position / bytes_per_second,
+            "ttfa": self.ttfa,
+            "age": time.time() - self.created,
+        }
+
+
+# Hands out the sentences of submitted jobs to the gen threads. A job's next
+# sentence is only handed out while its target has room for more audio, and
+# jobs sharing a target are served one after the other in submission order.
+# Playback comes first, being bounded by the look-ahead it can't keep the
+# workers for long, and the downloads with room take turns a sentence at a
+# time, so that a download that's read quickly can't hold up the others.
+# Targets must be created with this scheduler's condition so that consuming
+# from them wakes up waiting gen threads
+class Scheduler:
+    def __init__(self, limit, next_seq):
+        self.cond = threading.Condition()
+        self.limit = limit
+        self.next_seq = next_seq
+        self.jobs = []
+
+    def submit(self, job):
+        with self.cond:
+            self.jobs.append(job)
+            self.cond.notify_all()
+
+    def next(self):
+        # Returns (seq, job, index, generation) of the next sentence to
+        # synthesize
+        with self.cond:
+            while True:
+                item = self.pick()
+                if item is not None:
+                    return item
+                self.cond.wait()
+
+    def pick(self):
+        served = set()
+        download = None
+        for job in list(self.jobs):
+            if job.cancelled or job.dispatched == len(job.sentences):
+                self.jobs.remove(job)
+                continue
+
+            if id(job.target) in served:
+                continue
+            served.add(id(job.target))
+
+            if job.target.buffered() + job.target.pending >= self.limit:
+                continue
+            if not job.download:
+                return self.dispatch(job)
+            if download is None:
+                download = job
+
+        if download is None:
+            return None
+        # To the back of the line. Downloads have a target each, so this
+        # doesn't change the order of jobs sharing one
+        self.jobs.remove(download)
+        self.jobs.append(download)
+        return self.dispatch(download)
+
+    def dispatch(self, job):
+        job.dispatched += 1
+        return self.next_seq(), job, job.dispatched - 1, job.generation
+
+    def requeue(self, jobs):
+        # Serve these first, in this order. For jobs that have been rewound
+        with self.cond:
+            self.jobs = list(jobs) + [job for job in self.jobs if job not in jobs]
+            self.cond.notify_all()
+
+    def cancel_all(self):
+        with self.cond:
+            for job in self.jobs:
+                job.cancelled = True
+            self.jobs.clear()
+            self.cond.notify_all()
+
+    def pending(self):
+        # Sentences waiting to be played. Downloads are left out, they may be
+        # held back for as long as nobody fetches their audio
+        with self.cond:
+            return sum(
+                len(job.sentences) - job.dispatched
+                for job in self.jobs
+                if not job.cancelled and not job.download
+            )
+
+    def status(self):
+        with self.cond:
+            return {
+                "jobs": len(self.jobs),
+                "pending()": self.pending(),
+            }
@@ -1,18 +1,42 @@
-from desktop_notifier import DesktopNotifier
-from flask import Flask, request
-from unidecode import unidecode
+from flask import Flask, Response, request
 from locked import Locked
+from notifier import NOTIFY_MODES, Notifier
 from piper_backend import Piper
 from speechd_backend import Speechd
+from normalize import RULES, Normalizer
+from selection import SelectionWatcher
+from tts import MODES
+import encoder
+import metrics
 import argparse
+import asyncio
+import concurrent.futures
 import logging
 import shutil
+import signal
 import time
 import datetime
 import subprocess
 
 logger = logging.getLogger(__name__)
 
+has_waitress = True
+try:
+    import waitress
+except ImportError:
+    has_waitress = False
+
+has_hypercorn = True
+try:
+    import hypercorn.asyncio
+    import hypercorn.config
+    from async_server import AsyncApp
+except ImportError:
+    has_hypercorn = False
+
+# flask is its development server
+SERVERS = ("flask", "threaded", "asyncio")
+
 
 class App:
     def __init__(self, parsed):
@@ -27,8 +51,10 @@ class App:
             self.parsed.volume = 1 if self.parsed.volume is None else self.parsed.volume
         self.contain_speed_volume()
 
+        self.normalizer = Normalizer(self.parsed.ignore_chars, self.parsed.normalize)
+
         self.begin_time = time.time()
-        self.notifier = DesktopNotifier()
+        self.notifier = Notifier(self.parsed.notify)
 
         self.flask = Flask("tts-reader")
         self.flask.add_url_rule(
@@ -39,22 +65,56 @@ class App:
         self.flask.add_url_rule("/toggle", "toggle", view_func=self.toggle)
         self.flask.add_url_rule("/reset", "reset", view_func=self.reset)
         self.flask.add_url_rule("/skip", "skip", view_func=self.skip)
+        # Flask's float converter doesn't match whole numbers
+        self.flask.add_url_rule("/seek/<int:seconds>", "seek", view_func=self.seek)
+        self.flask.add_url_rule("/seek/<float:seconds>", "seek", view_func=self.seek)
+        self.flask.add_url_rule("/back", "back", view_func=self.back)
+        self.flask.add_url_rule("/next", "next", view_func=self.next)
         self.flask.add_url_rule("/volume/<float:data>", "volume", view_func=self.volume)
         self.flask.add_url_rule("/speed/<float:data>", "speed", view_func=self.speed)
         self.flask.add_url_rule("/status", "status", view_func=self.status)
+        self.flask.add_url_rule("/metrics", "metrics", view_func=self.metrics)
+        self.flask.add_url_rule("/jobs/<job_id>", "job", view_func=self.job)
+        self.flask.add_url_rule(
+            "/jobs/<job_id>/audio", "job_audio", view_func=self.job_audio
+        )
 
+        self.ffmpeg_path = shutil.which("ffmpeg")
+        self.find_paste_commands()
+
+        self.tts = self.make_tts()
+        if not self.tts.inited:
+            raise Exception("Failed to initialize the TTS backend")
+
+        # The last selection normalized ahead of a /read, and its text
+        self.prenormalized = Locked((None, None))
+        self.selection = None
+        if self.parsed.selection_watch:
+            self.selection = SelectionWatcher(
+                self.paste_command,
+                self.watch_command,
+                self.parsed.selection_poll,
+                self.prefetch if self.parsed.piper_prefetch else None,
+            )
+            self.selection.start()
+
+    def find_paste_commands(self):
         self.wlpaste_path = shutil.which("wl-paste")
         self.xclip_path = shutil.which("xclip")
         if self.parsed.wayland is True:
             if self.wlpaste_path is None:
                 raise Exception("Couldn't find the wl-paste binary")
+            self.paste_command = [self.wlpaste_path, "-p"]
+            self.watch_command = [self.wlpaste_path, "-p", "--watch", "echo"]
         else:
             if self.xclip_path is None:
                 raise Exception("Couldn't find the xclip binary")
+            self.paste_command = [self.xclip_path, "-o", "-selection primary"]
+            # xclip can't watch the selection, it's polled instead
+            self.watch_command = None
 
-        self.tts = Speechd(self.parsed) if self.parsed.speechd else Piper(self.parsed)
-        if not self.tts.inited:
-            raise Exception("Failed to initialize the TTS backend")
+    def make_tts(self):
+        return Speechd(self.parsed) if self.parsed.speechd else Piper(self.parsed)
 
     def contain_speed_volume(self):
         if self.parsed.speechd:
@@ -62,12 +122,24 @@ class App:
             self.parsed.speed = max(-100, min(self.parsed.speed, 100))
         else:
             self.parsed.volume = max(0.0, min(self.parsed.volume, 2.0))
-            self.parsed.speed = max(0.0, min(self.parsed.speed, 5.0))
+            self.parsed.speed = max(0.25, min(self.parsed.speed, 5.0))
 
     def read(self):
+        started = time.monotonic()
         num_chars = 0
 
         getaudio = request.args.get("getaudio", None) is not None
+        detach = request.args.get("detach", None) is not None
+        mode = request.args.get("mode", "enqueue")
+
+        error = self.check_format()
+        if error is not None:
+            return error
+
+        if mode not in MODES:
+            s = f"Unknown mode {mode}. Use one of {', '.join(MODES)}"
+            logger.error(s)
+            return s
 
         if request.method == "POST":
             if len(request.data) > 0:
@@ -76,7 +148,7 @@ class App:
                 except UnicodeError as e:
                     s = "Failed to decode the POSTed data as UTF-8"
                     logger.error("%s: %s", s, repr(e))
-                    self.notify(s)
+                    self.notify(s, error=True)
                     return s
 
                 num_chars = len(text)
@@ -88,50 +160,100 @@ class App:
                     s,
                     request.content_type,
                 )
-                self.notify(s)
+                self.notify(s, error=True)
                 return s
 
         else:
-            try:
-                out = subprocess.run(
-                    [self.wlpaste_path, "-p"]
-                    if self.parsed.wayland
-                    else [self.xclip_path, "-o", "-selection primary"],
-                    check=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                ).stdout
-
+            capture_started = time.monotonic()
+            out = None if self.selection is None else self.selection.get()
+            if out is None:
                 try:
-                    text = out.decode("utf-8")
-                except UnicodeError as e:
-                    s = "Failed to decode the selection clipboard data as UTF-8"
+                    out = subprocess.run(
+                        self.paste_command,
+                        check=True,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                    ).stdout
+                except subprocess.CalledProcessError as e:
+                    s = "Failed to get the clipboard contents. Maybe the selection clipboard is empty?"
                     logger.error("%s: %s", s, repr(e))
-                    self.notify(s)
+                    self.notify(s, error=True)
                     return s
 
-                num_chars = len(text)
-
-            except subprocess.CalledProcessError as e:
-                s = "Failed to get the clipboard contents. Maybe the selection clipboard is empty?"
+            try:
+                text = out.decode("utf-8")
+            except UnicodeError as e:
+                s = "Failed to decode the selection clipboard data as UTF-8"
                 logger.error("%s: %s", s, repr(e))
-                self.notify(s)
+                self.notify(s, error=True)
                 return s
 
-        for char in self.parsed.ignore_chars:
-            text = text.replace(char, "")
-        text = unidecode(text.strip()).replace("‐\n", "").replace("‐ ", "")
+            num_chars = len(text)
+            metrics.CAPTURE.observe(time.monotonic() - capture_started)
+
+        normalize_started = time.monotonic()
+        prenormalized_out, prenormalized_text = self.prenormalized.get()
+        if request.method == "GET" and out == prenormalized_out:
+            text = prenormalized_text
+        else:
+            text = self.normalizer.normalize(text)
+        metrics.NORMALIZATION.observe(time.monotonic() - normalize_started)
         if len(text) == 0:
             s = "Skipped processing empty text"
             self.notify(s)
             return s
 
+        job_id = self.tts.speak(text, getaudio, mode, started)
         s = f"Queued text of {num_chars} characters for the TTS"
         self.notify(s)
+        if getaudio and job_id is None:
+            return "The TTS backend doesn't support downloading audio"
+
+        if not getaudio or detach:
+            return {"job": job_id, "message": s}
+        return self.job_audio(job_id)
+
+    def prefetch(self, out):
+        # Called by the selection watcher with every new selection
+        try:
+            text = self.normalizer.normalize(out.decode("utf-8"))
+        except UnicodeError:
+            return
+        self.prenormalized.set((out, text))
+        self.tts.prefetch(text)
+
+    def job(self, job_id):
+        status = self.tts.job_status(job_id)
+        if status is None:
+            return "No such job", 404
+        return status
+
+    def job_audio(self, job_id):
+        error = self.check_format()
+        if error is not None:
+            return error
+
+        audio = self.tts.job_audio(job_id)
+        if audio is None:
+            return "No such download, or it's already being fetched", 404
+
+        fmt = request.args.get("format", "raw")
+        return Response(
+            encoder.encode(audio, fmt, self.parsed.piper_rate, self.ffmpeg_path),
+            content_type=encoder.content_type(fmt),
+        )
 
-        audio = self.tts.speak(text, getaudio)
-
-        return audio if getaudio else s
+    def check_format(self):
+        fmt = request.args.get("format", "raw")
+        if fmt not in encoder.FORMATS:
+            s = f"Unknown audio format {fmt}. Use one of {', '.join(encoder.FORMATS)}"
+            logger.error(s)
+            return s
+        if encoder.needs_ffmpeg(fmt) and self.ffmpeg_path is None:
+            s = f"Couldn't find the ffmpeg binary needed for {fmt}"
+            logger.error(s)
+            return s
+        return None
 
     def status(self):
         return {
@@ -140,8 +262,15 @@ class App:
                 "parsed": self.parsed.__dict__,
             },
             "self.tts": self.tts.status(),
+            "self.notifier": self.notifier.status(),
+            "self.selection": None
+            if self.selection is None
+            else self.selection.status(),
         }
 
+    def metrics(self):
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
     def toggle(self):
         self.tts.toggle()
         return ""
@@ -162,6 +291,18 @@ class App:
         self.tts.skip()
         return ""
 
+    def seek(self, seconds):
+        self.tts.seek(seconds)
+        return ""
+
+    def back(self):
+        self.tts.back()
+        return ""
+
+    def next(self):
+        self.tts.next()
+        return ""
+
     def speed(self, data):
         self.parsed.speed = data
         self.contain_speed_volume()
@@ -177,15 +318,90 @@ class App:
         return str(datetime.timedelta(seconds=int(diff)))
 
     def run(self):
-        self.flask.run(
-            host=self.parsed.ip, port=self.parsed.port, debug=self.parsed.debug
+        # Until interrupted. SIGTERM is taken as an interrupt too, so the piper
+        # and ffplay processes are stopped either way
+        try:
+            if self.parsed.server == "threaded":
+                self.run_threaded()
+            elif self.parsed.server == "asyncio":
+                self.run_asyncio()
+            else:
+                self.flask.run(
+                    host=self.parsed.ip, port=self.parsed.port, debug=self.parsed.debug
+                )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.info("Shutting down")
+            self.tts.shutdown()
+
+    def run_threaded(self):
+        if not has_waitress:
+            raise Exception("--server=threaded needs waitress. pip install waitress")
+
+        server = waitress.create_server(
+            self.flask,
+            host=self.parsed.ip,
+            port=self.parsed.port,
+            threads=self.parsed.server_threads,
+            channel_timeout=self.parsed.keep_alive,
+            ident="tts-reader",
         )
 
-    def notify(self, msg):
-        self.notifier.send_sync(title="TTS Reader", message=msg, timeout=2)
-
-
-if __name__ == "__main__":
+        def interrupt(signum, frame):
+            # Ends the downloads first, waitress waits for them to finish when
+            # it's interrupted
+            self.tts.shutdown()
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGINT, interrupt)
+        signal.signal(signal.SIGTERM, interrupt)
+        logger.info("Serving on http://%s:%d", self.parsed.ip, self.parsed.port)
+        try:
+            server.run()
+        finally:
+            server.close()
+
+    def run_asyncio(self):
+        if not has_hypercorn:
+            raise Exception(
+                "--server=asyncio needs hypercorn. pip install -r requirements.txt"
+            )
+
+        config = hypercorn.config.Config()
+        config.bind = [f"{self.parsed.ip}:{self.parsed.port}"]
+        config.keep_alive_timeout = self.parsed.keep_alive
+        config.accesslog = None
+
+        async def serve():
+            # Most routes are synchronous and run on the loop's default executor
+            loop = asyncio.get_running_loop()
+            loop.set_default_executor(
+                concurrent.futures.ThreadPoolExecutor(self.parsed.server_threads)
+            )
+            stop = asyncio.Event()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signum, stop.set)
+
+            async def shutdown_trigger():
+                await stop.wait()
+                # Ends the downloads, which would otherwise hold up the shutdown
+                self.tts.shutdown()
+
+            await hypercorn.asyncio.serve(
+                AsyncApp(self, config.wsgi_max_body_size),
+                config,
+                mode="asgi",
+                shutdown_trigger=shutdown_trigger,
+            )
+
+        asyncio.run(serve())
+
+    def notify(self, msg, error=False):
+        self.notifier.notify(msg, error)
+
+
+def make_parser():
     parser = argparse.ArgumentParser(
         prog="tts-reader",
     )
@@ -203,6 +419,24 @@ if __name__ == "__main__":
         action=argparse.BooleanOptionalAction,
         help="Attempt to use the piper python module. Has no effect if a different backend is selected",
     )
+    parser.add_argument(
+        "--piper-in-process",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Load the piper python module into the server instead of running piper in worker processes. Implies --piper-python",
+    )
+    parser.add_argument(
+        "--selection-watch",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Keep the primary selection in memory instead of getting it on every /read. Watched with wl-paste under Wayland, polled with xclip otherwise",
+    )
+    parser.add_argument(
+        "--selection-poll",
+        type=float,
+        default=0.25,
+        help="Seconds between polls of the selection with --selection-watch under X11",
+    )
     parser.add_argument(
         "--speechd",
         default=False,
@@ -219,7 +453,7 @@ if __name__ == "__main__":
         "--speed",
         type=float,
         default=None,
-        help="Speech rate. Piper: [0-5, def:1], Speechd: [-100-100, def:0]",
+        help="Speech rate. Piper: [0.25-5, def:1], Speechd: [-100-100, def:0]",
     )
     parser.add_argument(
         "--piper-rate",
@@ -237,7 +471,13 @@ if __name__ == "__main__":
         "--piper-one-sentence",
         default=False,
         action=argparse.BooleanOptionalAction,
-        help="Piper: Process one sentence at a time, instead of the default whole selection",
+        help="Piper: Skip one sentence at a time, instead of the default whole selection",
+    )
+    parser.add_argument(
+        "--piper-prefetch",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Piper: Synthesize the first sentence of every new selection before it's read. Needs --selection-watch",
     )
     parser.add_argument(
         "--piper-model", type=str, default=None, help="Piper: Path to the model"
@@ -248,6 +488,54 @@ if __name__ == "__main__":
         default=None,
         help="Piper: Path to the model configuration",
     )
+    parser.add_argument(
+        "--piper-workers",
+        type=int,
+        default=1,
+        help="Piper: Number of sentences to synthesize in parallel. Every worker loads its own copy of the model",
+    )
+    parser.add_argument(
+        "--piper-lookahead",
+        type=float,
+        default=15,
+        help="Piper: Seconds of audio to synthesize ahead of playback",
+    )
+    parser.add_argument(
+        "--piper-cache-dir",
+        type=str,
+        default=None,
+        help="Piper: Directory to keep synthesized audio in across restarts. Only kept in memory if unset",
+    )
+    parser.add_argument(
+        "--piper-cache-size",
+        type=float,
+        default=512,
+        help="Piper: Maximum size of the on-disk audio cache in MiB",
+    )
+    parser.add_argument(
+        "--piper-cache-memory",
+        type=float,
+        default=64,
+        help="Piper: Maximum size of the in-memory audio cache in MiB. 0 disables it",
+    )
+    parser.add_argument(
+        "--server",
+        choices=SERVERS,
+        default="flask",
+        help="HTTP server. flask: its development server, threaded: waitress, asyncio: hypercorn",
+    )
+    parser.add_argument(
+        "--server-threads",
+        type=int,
+        default=8,
+        help="Requests handled at a time by the threaded and asyncio servers. Downloads hold one for as long as they stream",
+    )
+    parser.add_argument(
+        "--keep-alive",
+        type=float,
+        default=30,
+        help="Seconds idle connections are kept open for by the threaded and asyncio servers",
+    )
     parser.add_argument(
         "--debug",
         default=False,
@@ -260,8 +548,25 @@ if __name__ == "__main__":
         default=[], 
         help='List of characters to ignore'
     )
+    parser.add_argument(
+        "--normalize",
+        nargs="*",
+        choices=list(RULES),
+        default=[],
+        help="Rewrite these in the text before reading it. code: skip code blocks, urls: read only the site of links, numbers: read 1,234 as one number",
+    )
+    parser.add_argument(
+        "--notify",
+        choices=NOTIFY_MODES,
+        default="all",
+        help="Desktop notifications to show. Bursts of them are shown as one",
+    )
+    return parser
 
-    parsed = parser.parse_args()
+
+if __name__ == "__main__":
+    parsed = make_parser().parse_args()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
 
     logging.basicConfig(
         encoding="utf-8", level=logging.DEBUG if parsed.debug else logging.INFO
@@ -0,0 +1,156 @@
+import bisect
+import threading
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+SYNTHESIS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+# Audio waits for up to --piper-lookahead seconds before it's played
+WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+
+# Metrics in the Prometheus text format. Recording takes a lock of the metric
+# alone for a couple of additions, so the gen and play threads never wait on
+# each other or on a scrape for long
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def get(self):
+        with self.lock:
+            return self.value
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self.get()}",
+        ]
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # Not cumulative, the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def total(self):
+        with self.lock:
+            return self.sum
+
+    def render(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+# A value computed when scraped
+class Gauge:
+    def __init__(self, name, help, get):
+        self.name = name
+        self.help = help
+        self.get = get
+
+    def render(self):
+        value = self.get()
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {'NaN' if value is None else value}",
+        ]
+
+
+CAPTURE = Histogram(
+    "tts_reader_capture_seconds", "Getting the selection for a GET /read"
+)
+NORMALIZATION = Histogram(
+    "tts_reader_normalization_seconds", "Normalizing the text of a /read"
+)
+SYNTHESIS = Histogram(
+    "tts_reader_synthesis_seconds",
+    "Synthesizing a sentence that wasn't cached",
+    SYNTHESIS_BUCKETS,
+)
+QUEUE_WAIT = Histogram(
+    "tts_reader_queue_wait_seconds",
+    "From a block of audio being synthesized to it starting to play",
+    WAIT_BUCKETS,
+)
+PLAYER_START = Histogram(
+    "tts_reader_player_start_seconds", "Starting the audio player"
+)
+TTFA = Histogram(
+    "tts_reader_time_to_first_audio_seconds",
+    "From a /read arriving to its first audio playing",
+)
+
+CHARACTERS = Counter("tts_reader_characters_total", "Characters queued for reading")
+SENTENCES = Counter("tts_reader_sentences_total", "Sentences synthesized")
+CACHED_SENTENCES = Counter(
+    "tts_reader_cached_sentences_total", "Sentences served from the audio cache"
+)
+AUDIO_SECONDS = Counter(
+    "tts_reader_audio_seconds_total", "Seconds of audio synthesized"
+)
+
+
+def real_time_factor():
+    audio = AUDIO_SECONDS.get()
+    return SYNTHESIS.total() / audio if audio > 0 else None
+
+
+REAL_TIME_FACTOR = Gauge(
+    "tts_reader_real_time_factor",
+    "Seconds spent synthesizing per second of audio synthesized",
+    real_time_factor,
+)
+
+METRICS = (
+    CAPTURE,
+    NORMALIZATION,
+    SYNTHESIS,
+    QUEUE_WAIT,
+    PLAYER_START,
+    TTFA,
+    CHARACTERS,
+    SENTENCES,
+    CACHED_SENTENCES,
+    AUDIO_SECONDS,
+    REAL_TIME_FACTOR,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,145 @@
+import codecs
+import re
+import threading
+from unidecode import unidecode
+
+
+def speak_url(match):
+    # Just the site, the rest of a URL is noise when read out
+    return f"link to {match.group('host')}"
+
+
+# Optional rules, enabled with --normalize. Each is a pattern, what to replace
+# its matches with, either a string or a function of the match, and strings
+# at least one of which the text has to contain for the rule to apply
+RULES = {
+    # Fenced code blocks are skipped, inline code loses its backticks
+    "code": (
+        r"```.*?(?:```|\Z)|`(?P<inline>[^`\n]+)`",
+        lambda m: m.group("inline") or "(code block)",
+        ("`",),
+    ),
+    "urls": (
+        r"\b(?:https?://|www\.)(?:www\.)?(?P<host>[\w.-]+)[^\s<>\"']*",
+        speak_url,
+        ("://", "www."),
+    ),
+    # 1,234,567 is read as a single number rather than a list of three
+    "numbers": (r"(?<=\d),(?=\d{3}\b)", "", (",",)),
+}
+
+# Always applied, before the optional rules. Words hyphenated across lines
+# with a hyphen proper or a soft hyphen are joined back together, and soft
+# hyphens dropped. ASCII hyphens are transliterated into, so they're left to
+# CLEANUP
+BASE_RULES = {
+    "hyphenation": (r"‐ *\n *|‐ |\xad\s*", "", ("‐", "\xad")),
+}
+
+# Clean up after the transliteration, where the only whitespace left is
+# spaces and newlines. Each is a substring that has to be in the text for the
+# pattern to match, the pattern and its replacement. Runs of spaces are
+# collapsed while keeping newlines for the segmenter, and lowercase words
+# hyphenated across lines joined. Plain string replacements and patterns
+# which start with a literal keep the regex engine in C
+CLEANUP = (
+    (" \n", re.compile(r"  *\n *"), "\n"),
+    ("\n ", re.compile(r"\n +"), "\n"),
+    ("  ", re.compile(r"  +"), " "),
+    ("-\n", re.compile(r"(?<=[a-z])-\n *(?=[a-z])"), ""),
+)
+
+
+# Whitespace other than newlines that can be left after the transliteration
+WHITESPACE = str.maketrans("\t\r\x0b\x0c\x1c\x1d\x1e\x1f", "        ")
+
+# The transliterations of runs of non-ASCII characters seen before. Bounded,
+# the oldest entry goes first, and long runs aren't worth remembering
+MEMO_SIZE = 4096
+MEMO_RUN = 32
+memo = {}
+memo_lock = threading.Lock()
+
+
+def unidecode_run(error):
+    # Encoding error handler called with every run of non-ASCII characters
+    run = error.object[error.start : error.end]
+    out = memo.get(run)
+    if out is None:
+        out = unidecode(run)
+        if len(run) <= MEMO_RUN:
+            with memo_lock:
+                if len(memo) >= MEMO_SIZE:
+                    del memo[next(iter(memo))]
+                memo[run] = out
+    return out, error.end
+
+
+codecs.register_error("tts-reader-unidecode", unidecode_run)
+
+
+def transliterate(text):
+    # The same as unidecode(text), which transliterates character by
+    # character. But pure ASCII text is returned as is, and otherwise encoding
+    # copies the ASCII stretches at C speed and only hands the runs in between
+    # to unidecode
+    if text.isascii():
+        return text
+    return text.encode("ascii", "tts-reader-unidecode").decode("ascii")
+
+
+# The text of every /read goes through this. Each stage is compiled once and
+# skipped when the text has nothing for it to do, which a substring search
+# finds out far quicker than a regex
+class Normalizer:
+    def __init__(self, ignore_chars=(), rules=()):
+        self.ignore_chars = [chars for chars in ignore_chars if len(chars) > 0]
+        # Removing single characters can't make new ones appear, so their
+        # order doesn't matter and one str.translate drops them all. Strings
+        # have to be removed in the given order, as one may span another
+        self.deletion = None
+        if all(len(chars) == 1 for chars in self.ignore_chars):
+            self.deletion = str.maketrans("", "", "".join(self.ignore_chars))
+        self.rules = {**BASE_RULES, **{name: RULES[name] for name in rules}}
+        self.patterns = {}
+
+    def pattern(self, names):
+        # One pattern for every combination of rules that apply to a text
+        if names not in self.patterns:
+            self.patterns[names] = re.compile(
+                "|".join(f"(?P<{name}>{self.rules[name][0]})" for name in names),
+                re.DOTALL,
+            )
+        return self.patterns[names]
+
+    def replace(self, match):
+        replacement = self.rules[match.lastgroup][1]
+        if isinstance(replacement, str):
+            return replacement
+        return replacement(match)
+
+    def normalize(self, text):
+        if self.deletion is None:
+            for chars in self.ignore_chars:
+                text = text.replace(chars, "")
+        # A search for a single character is a memchr()
+        elif any(chars in text for chars in self.ignore_chars):
+            text = text.translate(self.deletion)
+
+        names = tuple(
+            name
+            for name, (_, _, hints) in self.rules.items()
+            if any(hint in text for hint in hints)
+        )
+        if len(names) > 0:
+            text = self.pattern(names).sub(self.replace, text)
+
+        text = transliterate(text)
+        # A search for a single character is a memchr()
+        if any(chr(code) in text for code in WHITESPACE):
+            text = text.translate(WHITESPACE)
+
+        for hint, pattern, replacement in CLEANUP:
+            if hint in text:
+                text = pattern.sub(replacement, text)
+        return text.strip()
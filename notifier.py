@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import threading
+import time
+from desktop_notifier import DesktopNotifier
+
+logger = logging.getLogger(__name__)
+
+# Which messages are shown as desktop notifications
+NOTIFY_MODES = ("off", "errors", "all")
+
+# Messages sent this close together are shown as one notification, and
+# notifications are never shown more often than MIN_INTERVAL
+COALESCE_SECONDS = 0.2
+MIN_INTERVAL = 1.0
+# Lines of a coalesced notification, the rest are only counted
+MAX_LINES = 3
+
+
+# Desktop notifications sent from an event loop of their own, so that the
+# requests never wait on the D-Bus round trip
+class Notifier:
+    def __init__(self, mode="all", title="TTS Reader", timeout=2):
+        self.mode = mode
+        self.title = title
+        self.timeout = timeout
+
+        self.lock = threading.Lock()
+        self.pending = []
+        self.last_sent = 0.0
+
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.latency = None
+        self.max_latency = None
+        self.total_latency = 0.0
+
+        if self.mode == "off":
+            return
+        self.loop = asyncio.new_event_loop()
+        self.wakeup = asyncio.Event()
+        self.thread = threading.Thread(target=self.run_loop, daemon=True)
+        self.thread.start()
+
+    def notify(self, message, error=False):
+        # Returns right away, the notification is shown from the loop
+        if self.mode == "off" or (self.mode == "errors" and not error):
+            return
+        with self.lock:
+            self.pending.append((message, error, time.monotonic()))
+        self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.run())
+
+    async def run(self):
+        notifier = DesktopNotifier()
+        while True:
+            await self.wakeup.wait()
+            # Let the rest of a burst arrive
+            await asyncio.sleep(
+                max(COALESCE_SECONDS, self.last_sent + MIN_INTERVAL - time.monotonic())
+            )
+            self.wakeup.clear()
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if len(batch) == 0:
+                continue
+
+            try:
+                await notifier.send(
+                    title=self.title,
+                    message=self.combine(batch),
+                    timeout=self.timeout,
+                )
+            except Exception as e:
+                logger.error("Failed to send a notification: %s", repr(e))
+                self.failed += 1
+                continue
+            finally:
+                self.last_sent = time.monotonic()
+
+            # From the oldest message to it being shown
+            latency = self.last_sent - batch[0][2]
+            self.sent += 1
+            self.coalesced += len(batch) - 1
+            self.latency = latency
+            self.max_latency = max(latency, self.max_latency or 0.0)
+            self.total_latency += latency
+
+    def combine(self, batch):
+        # Errors first, repeated messages once
+        messages = list(
+            dict.fromkeys(
+                [message for message, error, _ in batch if error]
+                + [message for message, error, _ in batch if not error]
+            )
+        )
+        if len(messages) > MAX_LINES:
+            more = len(messages) - MAX_LINES
+            messages = messages[:MAX_LINES] + [f"and {more} more"]
+        return "\n".join(messages)
+
+    def status(self):
+        with self.lock:
+            pending = len(self.pending)
+        return {
+            "mode": self.mode,
+            "pending": pending,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+            "latency": self.latency,
+            "max_latency": self.max_latency,
+            "mean_latency": self.total_latency / self.sent if self.sent > 0 else None,
+        }
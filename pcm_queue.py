@@ -0,0 +1,132 @@
+import asyncio
+import collections
+import threading
+from ring_buffer import RingBuffer
+
+
+# FIFO of audio blocks which keeps count of how many bytes are waiting,
+# including the rest of the block being consumed and the audio that's been
+# synthesized for it but not put in yet. Producers use that to stay only a
+# bounded amount of audio ahead of the consumer. Items are tuples whose first
+# element is the audio. Consumers on an event loop use aget(), which waits
+# without a thread.
+# With a capacity, the audio is copied into a ring buffer of that size as it's
+# put and consumed as views of it, so that the queue's memory stays the same
+# however much goes through it. The consumer must be done with a block's view
+# by the time it calls done(). Blocks that don't fit are queued as they are
+class PcmQueue:
+    def __init__(self, cond=None, capacity=None):
+        self.cond = threading.Condition() if cond is None else cond
+        self.items = collections.deque()
+        self.size = 0
+        self.current = 0
+        self.pending = 0
+        self.closed = False
+        self.ring = None if capacity is None else RingBuffer(capacity)
+        # Whether the block being consumed is in the ring
+        self.current_in_ring = False
+        # (loop, future) of every aget() waiting for an item
+        self.waiters = []
+
+    def add_pending(self, size):
+        with self.cond:
+            self.pending = max(0, self.pending + size)
+
+    def put(self, item):
+        with self.cond:
+            self.pending = max(0, self.pending - len(item[0]))
+            if self.closed:
+                return
+            if self.ring is not None and len(item[0]) > 0:
+                audio = self.ring.write(item[0])
+                if audio is not None:
+                    item = (audio,) + item[1:]
+            self.items.append(item)
+            self.size += len(item[0])
+            self.cond.notify_all()
+            for loop, waiter in self.waiters:
+                loop.call_soon_threadsafe(wake, waiter)
+            self.waiters.clear()
+
+    def get(self):
+        with self.cond:
+            while len(self.items) == 0:
+                self.cond.wait()
+            return self.take()
+
+    async def aget(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.cond:
+                if len(self.items) > 0:
+                    return self.take()
+                waiter = loop.create_future()
+                self.waiters.append((loop, waiter))
+            await waiter
+
+    def take(self):
+        # Must be called with the condition held
+        item = self.items.popleft()
+        self.size -= len(item[0])
+        self.current = len(item[0])
+        self.current_in_ring = self.ring is not None and self.ring.owns(item[0])
+        return item
+
+    def consumed(self, size):
+        with self.cond:
+            size = min(size, self.current)
+            self.current -= size
+            if self.current_in_ring:
+                self.ring.release(size)
+            self.cond.notify_all()
+
+    def done(self):
+        with self.cond:
+            if self.current_in_ring:
+                self.ring.release(self.current)
+            self.current = 0
+            self.current_in_ring = False
+            self.cond.notify_all()
+
+    def clear(self):
+        with self.cond:
+            self.drop()
+            self.pending = 0
+            self.cond.notify_all()
+
+    def close(self):
+        # Nothing will be consumed from here on
+        with self.cond:
+            self.closed = True
+            self.drop()
+            self.pending = 0
+            self.cond.notify_all()
+
+    def drop(self):
+        # Must be called with the condition held. The block being consumed
+        # keeps its place in the ring until it's done
+        self.items.clear()
+        self.size = 0
+        if self.ring is not None:
+            self.ring.truncate(self.current if self.current_in_ring else 0)
+
+    def buffered(self):
+        with self.cond:
+            return self.size + self.current
+
+    def qsize(self):
+        return len(self.items)
+
+    def status(self):
+        with self.cond:
+            return {
+                "qsize()": len(self.items),
+                "buffered()": self.size + self.current,
+                "ring.status()": None if self.ring is None else self.ring.status(),
+            }
+
+
+def wake(waiter):
+    # The waiting aget() may have been cancelled since
+    if not waiter.done():
+        waiter.set_result(None)
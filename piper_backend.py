@@ -1,174 +1,538 @@
 from tts import TTS
+import contextlib
+import collections
 import importlib
 import logging
-import queue
+import metrics
 import shutil
-import signal
-import subprocess
-import sys
 import threading
 import time
+from audio_cache import AudioCache
+from audio_sink import PcmSink
+from jobs import Job, Scheduler
 from locked import Locked
+from pcm_queue import PcmQueue
+from piper_worker import PiperModuleWorker, PiperWorker, WorkerCancelled, WorkerError
+from reorder_buffer import ReorderBuffer
+from segment import MAX_CHARS, split_sentences
 
 logger = logging.getLogger(__name__)
 
+# Slowest speech the play queue's ring buffer is sized for
+MIN_CHARS_PER_SECOND = 10
+# Seconds a download can go without its audio being fetched before it's
+# cancelled, and how often that's checked
+DOWNLOAD_TIMEOUT = 60
+REAP_INTERVAL = 15
+
 
 class Piper(TTS):
     def __init__(self, parsed):
         super().__init__()
         self.parsed = parsed
         self.paused = False
-        self.reset_issued = Locked(False)
-        self.play_queue = queue.Queue()
-        self.gen_queue = queue.Queue()
-        self.get_queue = queue.Queue()
-        self.get_queue_lock = threading.Lock()
-        self.gen_process = Locked(None)
-        self.play_process = Locked(None)
+        self.unpaused = threading.Event()
+        self.unpaused.set()
+        self.playing = False
+        self.playing_chunk = 0
+        self.playing_job = None
+        self.skipped_chunk = 0
+        self.chunk_counter = 0
+        # Bumped by every reset. Work of jobs from an earlier epoch is dropped
+        # wherever it's next touched
+        self.epoch = 0
+        self.lookahead = int(self.parsed.piper_lookahead * self.parsed.piper_rate) * 2
+        self.underruns = 0
+        self.seq_counter = Locked(0)
+        self.scheduler = Scheduler(self.lookahead, self.next_seq)
+        # The scheduler starts a sentence whenever less than the look-ahead is
+        # buffered, so up to a sentence per worker more than that can arrive
+        longest = int(MAX_CHARS / MIN_CHARS_PER_SECOND * self.parsed.piper_rate) * 2
+        self.play_queue = PcmQueue(
+            self.scheduler.cond,
+            self.lookahead + max(1, self.parsed.piper_workers) * longest,
+        )
+        self.reorder = ReorderBuffer()
+        self.jobs = collections.OrderedDict()
+        self.jobs_lock = threading.Lock()
+        self.max_jobs = 64
+        # The job each gen thread's worker is synthesizing, and its generation
+        self.assignments = {}
+        self.stats_lock = threading.Lock()
+        self.first_pcm_latency = None
+        self.ttfa = None
+        self.sentences = 0
+        self.reused_sentences = 0
+        self.chars = 0
+        self.reused_chars = 0
+        self.prefetches = 0
 
         self.ffplay_path = shutil.which("ffplay")
+        self.sink = self.make_sink()
+        self.cache = AudioCache(self.parsed)
+
+        if not self.find_piper():
+            self.inited = False
+            return
+
+        # Load the models now rather than on the first request
+        self.workers = [
+            self.make_worker() for _ in range(max(1, self.parsed.piper_workers))
+        ]
+        for worker in self.workers:
+            worker.start()
+        self.assignments = {worker: None for worker in self.workers}
+        self.sink.start()
+
+        self.gen_threads = [
+            threading.Thread(target=self.run_gen_thread, args=(worker,), daemon=True)
+            for worker in self.workers
+        ]
+        self.emit_thread = threading.Thread(target=self.run_emit_thread, daemon=True)
+        self.play_thread = threading.Thread(target=self.run_play_thread, daemon=True)
+        self.reap_thread = threading.Thread(target=self.run_reap_thread, daemon=True)
+
+        for thread in self.gen_threads:
+            thread.start()
+        self.emit_thread.start()
+        self.play_thread.start()
+        self.reap_thread.start()
+        self.inited = True
 
+    def find_piper(self):
         self.piper_path = shutil.which("piper-tts")
         if self.piper_path is None and not self.parsed.piper_python:
             logger.warning("The piper C++ executable was not found")
 
-        self.is_piper_python = self.piper_path is None or self.parsed.piper_python
+        self.is_piper_python = (
+            self.piper_path is None
+            or self.parsed.piper_python
+            or self.parsed.piper_in_process
+        )
         if self.is_piper_python:
             if importlib.util.find_spec("piper") is None:
                 logger.critical("The piper python module was not found")
-                self.inited = False
-                return
+                return False
+        return True
 
-        self.gen_thread = threading.Thread(target=self.run_gen_thread, daemon=True)
-        self.play_thread = threading.Thread(target=self.run_play_thread, daemon=True)
+    def make_sink(self):
+        return PcmSink(self.parsed, self.ffplay_path)
 
-        self.gen_thread.start()
-        self.play_thread.start()
-        self.inited = True
+    def make_worker(self):
+        if self.parsed.piper_in_process:
+            return PiperModuleWorker(self.parsed)
+        return PiperWorker(self.parsed, self.piper_path, self.is_piper_python)
 
     def run_play_thread(self):
+        continuing = False
         while True:
-            if self.get_queue_lock.locked():
-                # None of our business. User is downloading audio
-                time.sleep(0.5)
-                continue
-
-            audio = self.play_queue.get()
-            if self.reset_issued.get():
-                self.play_queue.task_done()
-                continue
-
+            audio, started, chunk, job, generation, offset, queued = (
+                self.play_queue.get()
+            )
+            metrics.QUEUE_WAIT.observe(time.monotonic() - queued)
             try:
-                self.play_process.set(
-                    subprocess.Popen(
-                        [
-                            self.ffplay_path,
-                            "-hide_banner",
-                            "-loglevel",
-                            "panic",
-                            "-nostats",
-                            "-autoexit",
-                            "-nodisp",
-                            "-af",
-                            f"atempo={self.parsed.speed},volume={self.parsed.volume}",
-                            "-f",
-                            "s16le",
-                            "-ar",
-                            f"{self.parsed.piper_rate}",
-                            "-ac",
-                            "1",
-                            "-",
-                        ],
-                        stdin=subprocess.PIPE,
-                    )
-                )
-                self.play_process.get().communicate(input=audio)
+                if self.stale(job, chunk, generation):
+                    self.sink.discard()
+                    continuing = False
+                    continue
+
+                if started is not None:
+                    self.ttfa = job.ttfa = time.monotonic() - started
+                    metrics.TTFA.observe(self.ttfa)
+                elif continuing and self.sink.buffered() == 0:
+                    # The previous block of this request has finished playing
+                    # before this one was generated
+                    self.underruns += 1
+
+                # Feed the sink a slice at a time so pause, skip and reset
+                # take effect within a slice of where playback is
+                self.playing = True
+                self.playing_chunk = chunk
+                self.playing_job = job
+                continuing = False
+                view = memoryview(audio)
+                i = 0
+                while i < len(view):
+                    self.unpaused.wait()
+                    if self.stale(job, chunk, generation):
+                        self.sink.discard()
+                        break
+                    if job.skipped(offset + i):
+                        # Seeked forward past this slice
+                        end = len(view)
+                        if job.sentence_at(offset + i) >= job.resume_index:
+                            end = min(end, job.resume - offset)
+                        self.sink.discard()
+                        self.play_queue.consumed(end - i)
+                        job.position = offset + end
+                        i = end
+                        continue
+                    audio_slice = view[i : i + self.sink.slice_size]
+                    self.sink.write(audio_slice)
+                    self.play_queue.consumed(len(audio_slice))
+                    job.played_bytes += len(audio_slice)
+                    job.position = offset + i + len(audio_slice)
+                    i += len(audio_slice)
+                else:
+                    continuing = True
             finally:
-                self.play_process.set(None)
-                self.play_queue.task_done()
+                if self.play_queue.qsize() == 0:
+                    self.sink.flush()
+                self.play_queue.done()
+                self.playing = (
+                    self.play_queue.qsize() > 0
+                    or self.scheduler.pending() > 0
+                    or any(w.request_lock.locked() for w in self.workers)
+                )
 
-    def run_gen_thread(self):
-        while True:
-            text, getaudio = self.gen_queue.get()
-            if self.reset_issued.get():
-                self.gen_queue.task_done()
-                continue
+    def expired(self, job):
+        return job.cancelled or job.epoch != self.epoch
 
+    def stale(self, job, chunk, generation):
+        return (
+            self.expired(job)
+            or chunk <= self.skipped_chunk
+            or generation != job.generation
+        )
+
+    def run_gen_thread(self, worker):
+        while True:
+            item = self.scheduler.next()
+            seq, job, index, generation = item
+            self.assignments[worker] = (job, generation)
             try:
-                prefix = [self.piper_path]
-                if self.is_piper_python:
-                    prefix = [sys.executable, "-m", "piper"]
-
-                self.gen_process.set(
-                    subprocess.Popen(
-                        prefix
-                        + [
-                            "--output_raw",
-                            "--sentence_silence",
-                            f"{self.parsed.piper_sentence_silence}",
-                            "--model",
-                            self.parsed.piper_model,
-                            "--config",
-                            self.parsed.piper_model_config,
-                        ],
-                        stdin=subprocess.PIPE,
-                        stdout=subprocess.PIPE,
-                    )
-                )
-                out, _ = self.gen_process.get().communicate(input=text.encode())
+                if self.expired(job) or generation != job.generation:
+                    continue
+
+                text = job.sentences[index]
+                with contextlib.closing(self.generate(text, worker)) as stream:
+                    for out in stream:
+                        if self.expired(job) or generation != job.generation:
+                            break
+                        job.target.add_pending(len(out))
+                        self.reorder.put(item, out)
+            except WorkerCancelled:
+                pass
+            except WorkerError as e:
+                logger.error("%s", e)
             finally:
-                self.gen_process.set(None)
-                self.gen_queue.task_done()
-
-            if getaudio:
-                self.get_queue.put(b"" if len(out) == 0 else out)
-            elif len(out) > 0:
-                self.play_queue.put(out)
+                self.assignments[worker] = None
+                self.reorder.finish(item)
 
-    def speak(self, text, getaudio):
-        tokens = [text]
-        audio = b""
-
-        done = lambda: audio if getaudio else None
+    def run_emit_thread(self):
+        # Hand each block to its job's target in order as soon as it's available
+        last_seq = None
+        while True:
+            (seq, job, index, generation), out = self.reorder.get()
+
+            # Rewinds change the jobs under the scheduler's condition
+            with self.scheduler.cond:
+                if generation != job.generation:
+                    if out is not None:
+                        job.target.add_pending(-len(out))
+                    continue
+
+                if out is None:
+                    job.synthesized += 1
+                    job.ends.append(job.generated_bytes)
+                    if job.download and job.synthesized == len(job.sentences):
+                        job.target.put((b"", True))
+                    continue
+
+                if self.expired(job):
+                    job.target.add_pending(-len(out))
+                    continue
+
+                # Only the first block of a job carries its start time.
+                # Prefetches have none, no request is waiting on them
+                started = None
+                if (
+                    index == 0
+                    and seq != last_seq
+                    and job.ttfa is None
+                    and job.started is not None
+                ):
+                    started = job.started
+                last_seq = seq
+
+                if started is not None:
+                    self.first_pcm_latency = time.monotonic() - started
+                    if job.download:
+                        job.ttfa = self.first_pcm_latency
+
+                offset = job.generated_bytes
+                job.generated_bytes += len(out)
+                if index < job.resume_index:
+                    cut = len(out)
+                else:
+                    cut = min(len(out), max(0, job.resume - offset))
+                if cut > 0:
+                    # Audio before where playback was moved to
+                    job.target.add_pending(-cut)
+                    out = out[cut:]
+                    offset += cut
+
+                if job.download:
+                    job.target.put((out, False))
+                elif len(out) > 0:
+                    chunk = job.chunk + (index if self.parsed.piper_one_sentence else 0)
+                    self.play_queue.put(
+                        (out, started, chunk, job, generation, offset, time.monotonic())
+                    )
 
+    def generate(self, text, worker):
+        key = self.cache.key(text)
+        audio = self.cache.get(key)
+
+        with self.stats_lock:
+            self.sentences += 1
+            self.chars += len(text)
+            if audio is not None:
+                self.reused_sentences += 1
+                self.reused_chars += len(text)
+
+        if audio is not None:
+            metrics.CACHED_SENTENCES.inc()
+            yield audio
+            return
+
+        blocks = []
+        started = time.monotonic()
+        with contextlib.closing(worker.stream(text)) as stream:
+            for out in stream:
+                blocks.append(out)
+                yield out
+
+        # Only reached if the whole utterance was synthesized and consumed
+        if len(blocks) > 0:
+            audio = b"".join(blocks)
+            metrics.SYNTHESIS.observe(time.monotonic() - started)
+            metrics.SENTENCES.inc()
+            metrics.AUDIO_SECONDS.inc(len(audio) / self.sink.bytes_per_second)
+            self.cache.put(key, audio)
+
+    def speak(self, text, getaudio, mode="enqueue", started=None):
+        # Queues text and returns the id of its job right away. Downloads are
+        # then fetched with job_audio(). Playback is queued according to mode.
+        # Time to first audio is counted from started, when the request came in
+        if started is None:
+            started = time.monotonic()
+        metrics.CHARACTERS.inc(len(text))
+
+        # Every sentence is synthesized and cached on its own, so that playback
+        # starts after the first one and overlapping selections share audio.
+        # Only the skip granularity depends on --piper-one-sentence
+        sentences = split_sentences(text)
+        target = PcmQueue(self.scheduler.cond) if getaudio else self.play_queue
+        job = Job(text, sentences, target, getaudio, started)
+
+        with self.jobs_lock:
+            job.epoch = self.epoch
+            if not getaudio:
+                self.assign_chunk(job)
+            self.jobs[job.id] = job
+            # Forget the oldest finished jobs
+            for old in list(self.jobs.values()):
+                if len(self.jobs) <= self.max_jobs:
+                    break
+                if old.finished() and (
+                    not old.download or old.claimed or old.cancelled
+                ):
+                    del self.jobs[old.id]
+
+        if len(sentences) == 0 and getaudio:
+            target.put((b"", True))
+
+        if getaudio or mode == "enqueue":
+            self.scheduler.submit(job)
+        elif mode == "interrupt":
+            self.interrupt(job)
+        else:
+            self.preempt(job)
+        return job.id
+
+    def prefetch(self, text):
+        # Synthesizes the first sentence of text into the cache, so that a
+        # /read of it starts from there. Only while nothing is waiting to be
+        # played and a worker is free, the audio itself is thrown away.
+        # Downloads held back by the look-ahead don't count, they aren't
+        # using a worker
+        if self.scheduler.pending() > 0 or all(
+            worker.request_lock.locked() for worker in self.workers
+        ):
+            return
+        sentences = split_sentences(text)[:1]
+        if len(sentences) == 0 or self.cache.contains(self.cache.key(sentences[0])):
+            return
+
+        target = PcmQueue(self.scheduler.cond)
+        target.close()
+        job = Job(text, sentences, target, True, None)
+        job.epoch = self.epoch
+        self.scheduler.submit(job)
+        with self.stats_lock:
+            self.prefetches += 1
+
+    def assign_chunk(self, job):
+        # Chunks are numbered in the order they're to be played. Must be
+        # called with jobs_lock held
+        job.chunk = self.chunk_counter + 1
         if self.parsed.piper_one_sentence:
-            tokens = text.split(".")
-            for i in range(len(tokens)):
-                tokens[i] = tokens[i].strip() + "."
-
-        self.reset_issued.set(False)
-
-        # This lock is important because if another request arrives, results
-        # could possibly get mixed up get()ing from multiple places simultaneously
-        # A better solution could be a separate thread for getaudio
-        with self.get_queue_lock:
-            for text in tokens:
-                if self.reset_issued.get():
-                    return done()
-                self.gen_queue.put((text, getaudio))
-
-            if getaudio:
-                for i in range(len(tokens)):
-                    if self.reset_issued.get():
-                        audio = b""
-                        return done()
-                    audio += self.get_queue.get()
-                    self.get_queue.task_done()
-
-        return done()
+            self.chunk_counter += len(job.sentences)
+        else:
+            self.chunk_counter += 1
+
+    def queued_playback(self, job):
+        # The jobs other than job whose audio hasn't all been played yet, in
+        # the order they're to be played
+        return sorted(
+            (
+                j
+                for j in self.jobs.values()
+                if j is not job
+                and not j.download
+                and not self.expired(j)
+                and (not j.finished() or j.position < j.generated_bytes)
+            ),
+            key=lambda j: j.chunk,
+        )
+
+    def interrupt(self, job):
+        # Drop everything that's being or waiting to be played and play job
+        with self.jobs_lock, self.scheduler.cond:
+            for j in self.queued_playback(job):
+                self.cancel_job(j)
+            self.play_queue.clear()
+            self.scheduler.submit(job)
+
+        self.cancel_stale_work()
+
+    def preempt(self, job):
+        # Play job right away, then pick up what was being played where it
+        # was left off. Its sentences that have been synthesized come out of
+        # the cache then, the rest are synthesized when it's resumed
+        with self.jobs_lock, self.scheduler.cond:
+            resumed = self.queued_playback(job)
+            for j in resumed:
+                j.rewind(j.sentence_at(j.position), j.position)
+                self.assign_chunk(j)
+            self.play_queue.clear()
+            self.scheduler.requeue([job] + resumed)
+
+        self.cancel_stale_work()
+
+    def job_status(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        return job.status(self.sink.bytes_per_second)
+
+    def job_audio(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or not job.download or job.claimed:
+            return None
+        job.claimed = True
+        job.touched = time.monotonic()
+        return self.download(job)
+
+    def download(self, job):
+        # Yields the audio of every sentence in order as it's synthesized. At
+        # most the look-ahead is ever buffered, however long the text is
+        try:
+            while True:
+                job.waiting = True
+                try:
+                    audio, end = job.target.get()
+                finally:
+                    job.waiting = False
+                job.target.done()
+                job.touched = time.monotonic()
+                if end:
+                    return
+                if len(audio) > 0:
+                    yield audio
+        finally:
+            if not job.finished():
+                self.cancel_job(job)
+            job.target.close()
+
+    def ajob_audio(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or not job.download or job.claimed:
+            return None
+        job.claimed = True
+        job.touched = time.monotonic()
+        return self.adownload(job)
+
+    async def adownload(self, job):
+        # download() for event loops, so that any number of downloads can
+        # stream without a thread each
+        try:
+            while True:
+                job.waiting = True
+                try:
+                    audio, end = await job.target.aget()
+                finally:
+                    job.waiting = False
+                job.target.done()
+                job.touched = time.monotonic()
+                if end:
+                    return
+                if len(audio) > 0:
+                    yield audio
+        finally:
+            if not job.finished():
+                self.cancel_job(job)
+            job.target.close()
+
+    def run_reap_thread(self):
+        while True:
+            time.sleep(REAP_INTERVAL)
+            self.expire_downloads()
+
+    def expire_downloads(self):
+        # Cancels downloads that were never fetched, or whose client stopped
+        # reading with audio left buffered, so that it doesn't stay buffered
+        # for good. A reader waiting for audio is never given up on, however
+        # long the synthesis takes
+        now = time.monotonic()
+        with self.jobs_lock, self.scheduler.cond:
+            expired = [
+                job
+                for job in self.jobs.values()
+                if job.download
+                and not job.cancelled
+                and not job.target.closed
+                and not job.waiting
+                and (not job.claimed or job.target.buffered() > 0)
+                and now - job.touched > DOWNLOAD_TIMEOUT
+            ]
+            for job in expired:
+                self.cancel_job(job)
+        if len(expired) > 0:
+            logger.info("Cancelled %d downloads nobody fetched", len(expired))
+            self.cancel_stale_work()
+
+    def cancel_job(self, job):
+        job.cancelled = True
+        if job.download:
+            # Let whoever is downloading it know
+            job.target.clear()
+            job.target.put((b"", True))
+
+    def next_seq(self):
+        with self.seq_counter.lock:
+            self.seq_counter.data += 1
+            return self.seq_counter.data - 1
 
     def play(self):
-        self.reset_issued.set(False)
         self.paused = False
-        with self.play_process.lock:
-            if self.play_process.data is not None:
-                self.play_process.data.send_signal(signal.SIGCONT)
+        self.unpaused.set()
 
     def pause(self):
-        with self.play_process.lock:
-            if self.play_process.data is not None:
-                self.play_process.data.send_signal(signal.SIGSTOP)
-                self.paused = True
+        if self.playing:
+            self.paused = True
+            self.unpaused.clear()
 
     def toggle(self):
         if self.paused:
@@ -178,53 +542,144 @@ class Piper(TTS):
 
     def skip(self):
         self.play()
-        with self.play_process.lock:
-            if self.play_process.data is not None:
-                self.play_process.data.terminate()
-
-    def reset(self):
-        # Make sure more commands aren't enqueued
-        self.reset_issued.set(True)
-        time.sleep(0.25)
+        job = self.playing_job
+        self.skipped_chunk = self.playing_chunk
+        if job is None or self.parsed.piper_one_sentence:
+            return
+
+        # The chunk is the whole job, so the rest of it needn't be synthesized
+        # before what's queued behind it
+        with self.jobs_lock, self.scheduler.cond:
+            if not self.expired(job):
+                self.cancel_job(job)
+        self.cancel_stale_work()
+
+    def seek(self, seconds):
+        job = self.playing_job
+        if job is not None:
+            self.seek_to(job, int(seconds * self.parsed.piper_rate) * 2)
+
+    def back(self):
+        # To the start of the sentence being played, or of the one before it
+        # if that's less than a second ago
+        job = self.playing_job
+        if job is None:
+            return
+        index = min(job.sentence_at(job.position), len(job.sentences) - 1)
+        start = job.sentence_start(index)
+        if job.position - start < self.sink.bytes_per_second and index > 0:
+            start = job.sentence_start(index - 1)
+        self.seek_to(job, start)
+
+    def next(self):
+        job = self.playing_job
+        if job is None:
+            return
+        index = job.sentence_at(job.position) + 1
+        if index >= len(job.sentences):
+            self.skip()
+        elif index > len(job.ends):
+            # The sentence being played hasn't been synthesized to its end yet
+            with self.scheduler.cond:
+                job.forward(index, 0)
+        else:
+            self.seek_to(job, job.sentence_start(index))
+
+    def seek_to(self, job, offset):
+        # Moves playback of job to offset bytes into its audio. Ahead of the
+        # playback position this drops the audio in between, behind it the
+        # sentences from there on are synthesized again, which normally means
+        # taken from the cache
+        if self.expired(job):
+            return
+
+        with self.jobs_lock, self.scheduler.cond:
+            # Only within what's been synthesized
+            offset = max(0, min(offset, job.generated_bytes)) // 2 * 2
+            index = job.sentence_at(offset)
+
+            if offset >= job.position:
+                job.forward(index, offset)
+                return
 
-        self.stop_gen_process()
-        self.stop_play_process()
+            # The jobs queued after this one have to come after it again
+            later = [
+                j
+                for j in self.jobs.values()
+                if not j.download and not self.expired(j) and j.chunk > job.chunk
+            ]
+            job.rewind(index, offset)
+            for j in later:
+                j.rewind(0, 0)
+            self.play_queue.clear()
+            self.scheduler.requeue([job] + later)
+            self.skipped_chunk = min(self.skipped_chunk, job.chunk - 1)
 
+    def reset(self):
+        # Nothing is waited for. Whatever the threads are doing for the jobs
+        # reset here is dropped the next time they look at it, and jobs
+        # submitted from here on belong to the new epoch
         self.paused = False
-
-        while self.gen_queue.qsize() > 0:
-            self.gen_queue.get()
-            self.gen_queue.task_done()
-        while self.play_queue.qsize() > 0:
-            self.play_queue.get()
-            self.play_queue.task_done()
-        while self.get_queue.qsize() > 0:
-            self.get_queue.get()
-            self.get_queue.task_done()
-
-    def stop_play_process(self):
-        with self.play_process.lock:
-            if self.play_process.data is not None:
-                self.play_process.data.terminate()
-
-    def stop_gen_process(self):
-        with self.gen_process.lock:
-            if self.gen_process.data is not None:
-                self.gen_process.data.terminate()
+        self.unpaused.set()
+
+        with self.jobs_lock, self.scheduler.cond:
+            self.epoch += 1
+            for job in self.jobs.values():
+                if not job.finished():
+                    self.cancel_job(job)
+            self.scheduler.cancel_all()
+
+            # Anything still being synthesized is dropped on arrival
+            with self.seq_counter.lock:
+                self.reorder.skip_to(self.seq_counter.data)
+            self.play_queue.clear()
+
+        self.cancel_stale_work()
+
+    def shutdown(self):
+        if not self.inited:
+            return
+        self.reset()
+        for worker in self.workers:
+            worker.stop()
+        self.sink.stop()
+
+    def cancel_stale_work(self):
+        # Stop the workers synthesizing for jobs that were cancelled or rewound
+        for worker, assignment in list(self.assignments.items()):
+            if assignment is None:
+                continue
+            job, generation = assignment
+            if self.expired(job) or generation != job.generation:
+                worker.cancel()
 
     def status(self):
         return {
             "paused": self.paused,
-            "reset_issued.get()": self.reset_issued.get(),
-            "gen_queue.qsize()": self.gen_queue.qsize(),
-            "play_queue.qsize()": self.play_queue.qsize(),
-            "get_queue.qsize()": self.get_queue.qsize(),
-            "gen_process.get().pid?": None
-            if self.gen_process.get() is None
-            else self.gen_process.get().pid,
-            "play_process.get().pid?": None
-            if self.play_process.get() is None
-            else self.play_process.get().pid,
-            "gen_thread.is_alive()": self.gen_thread.is_alive(),
+            "epoch": self.epoch,
+            "scheduler.status()": self.scheduler.status(),
+            "play_queue.status()": self.play_queue.status(),
+            "buffered_seconds": (self.play_queue.buffered() + self.reorder.size)
+            / self.sink.bytes_per_second,
+            "lookahead_seconds": self.parsed.piper_lookahead,
+            "underruns": self.underruns,
+            "len(jobs)": len(self.jobs),
+            "workers": [worker.status() for worker in self.workers],
+            "assignments": [
+                None if a is None else a[0].id for a in self.assignments.values()
+            ],
+            "reorder.status()": self.reorder.status(),
+            "cache.status()": self.cache.status(),
+            "sentence_reuse": self.reused_sentences / self.sentences
+            if self.sentences > 0
+            else None,
+            "char_reuse": self.reused_chars / self.chars if self.chars > 0 else None,
+            "prefetches": self.prefetches,
+            "first_pcm_latency": self.first_pcm_latency,
+            "ttfa": self.ttfa,
+            "sink.status()": self.sink.status(),
+            "gen_threads.is_alive()": [t.is_alive() for t in self.gen_threads],
+            "emit_thread.is_alive()": self.emit_thread.is_alive(),
             "play_thread.is_alive()": self.play_thread.is_alive(),
+            "reap_thread.is_alive()": self.reap_thread.is_alive(),
         }
@@ -0,0 +1,396 @@
+import argparse
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from locked import Locked
+
+logger = logging.getLogger(__name__)
+
+# Every frame the python driver writes is prefixed with its length. A zero
+# length frame marks the end of an utterance
+FRAME_HEADER = struct.Struct("<I")
+# Seconds a cancelled utterance of the python driver has to finish before the
+# driver is restarted
+DRAIN_TIMEOUT = 3
+
+
+class WorkerError(Exception):
+    pass
+
+
+class WorkerCancelled(WorkerError):
+    pass
+
+
+# A long lived piper process which loads the model once and then synthesizes
+# one utterance per line of stdin
+class PiperWorker:
+    def __init__(self, parsed, piper_path, is_piper_python):
+        self.parsed = parsed
+        self.piper_path = piper_path
+        self.is_piper_python = is_piper_python
+        self.process = Locked(None)
+        self.request_lock = threading.Lock()
+        self.output_dir = None
+        self.cancelled = Locked(False)
+        self.requests = 0
+
+        self.warm = False
+        self.uses = 0
+        self.total_uses = 0
+        self.restarts = 0
+        self.crashes = 0
+        self.started_at = None
+        self.created_at = time.monotonic()
+        self.busy_time = 0.0
+
+    def command(self):
+        args = [
+            "--model",
+            self.parsed.piper_model,
+            "--config",
+            self.parsed.piper_model_config,
+            "--sentence_silence",
+            f"{self.parsed.piper_sentence_silence}",
+        ]
+
+        if self.is_piper_python:
+            return [sys.executable, os.path.abspath(__file__)] + args
+
+        # The C++ binary has no framing for raw output, so make it write a
+        # WAV file per line and print its path instead
+        if self.output_dir is None:
+            self.output_dir = tempfile.mkdtemp(prefix="tts-reader-")
+        return [self.piper_path] + args + ["--output_dir", self.output_dir]
+
+    def start(self):
+        with self.process.lock:
+            if self.process.data is not None and self.process.data.poll() is None:
+                return
+
+            if self.started_at is not None:
+                self.restarts += 1
+
+            try:
+                self.process.data = subprocess.Popen(
+                    self.command(),
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                )
+            except OSError as e:
+                logger.error("Failed to start the piper worker: %s", repr(e))
+                self.process.data = None
+                return
+
+            self.warm = False
+            self.uses = 0
+            self.started_at = time.time()
+            logger.info("Started the piper worker (pid %d)", self.process.data.pid)
+
+    def stop(self):
+        with self.process.lock:
+            if self.process.data is not None:
+                self.process.data.terminate()
+                self.process.data = None
+
+        if self.output_dir is not None:
+            shutil.rmtree(self.output_dir, ignore_errors=True)
+            self.output_dir = None
+
+    def cancel(self):
+        # The python driver is left to finish the utterance, which is at most
+        # a chunk, so that it keeps its model loaded. It's only restarted if
+        # that takes too long. The C++ binary can't be stopped mid-utterance,
+        # so it's restarted right away to be warm again by the next request
+        if not self.request_lock.locked():
+            return
+
+        self.cancelled.set(True)
+        if self.is_piper_python:
+            timer = threading.Timer(
+                DRAIN_TIMEOUT, self.kill_request, args=(self.requests,)
+            )
+            timer.daemon = True
+            timer.start()
+            return
+        self.kill_request(self.requests)
+
+    def kill_request(self, request):
+        with self.process.lock:
+            if (
+                self.request_lock.locked()
+                and self.requests == request
+                and self.process.data is not None
+            ):
+                self.process.data.terminate()
+
+    def stream(self, text):
+        # Yields the raw s16le audio of text as piper produces it. Raises
+        # WorkerError if piper died twice in a row, or WorkerCancelled
+        text = " ".join(text.split())
+        if len(text) == 0:
+            return
+
+        with self.request_lock:
+            self.cancelled.set(False)
+            self.requests += 1
+            began = time.monotonic()
+            try:
+                yield from self.attempt(text)
+            finally:
+                self.busy_time += time.monotonic() - began
+
+    def attempt(self, text):
+        for _ in range(2):
+            self.start()
+            process = self.process.get()
+            if process is None:
+                raise WorkerError("The piper worker couldn't be started")
+
+            yielded = False
+            reader = self.read_utterance(process)
+            try:
+                process.stdin.write(text.encode() + b"\n")
+                process.stdin.flush()
+                for audio in reader:
+                    if self.cancelled.get():
+                        self.drain(reader)
+                        raise WorkerCancelled("Cancelled")
+                    yielded = True
+                    yield audio
+
+                self.warm = True
+                self.uses += 1
+                self.total_uses += 1
+                return
+
+            except GeneratorExit:
+                if not self.is_piper_python:
+                    # The C++ binary's WAV was read whole, so it's idle and
+                    # can take the next line as it is
+                    self.warm = True
+                    self.uses += 1
+                    self.total_uses += 1
+                    raise
+                # The rest of this utterance is still coming down the pipe
+                try:
+                    self.drain(reader)
+                except (OSError, ValueError, EOFError):
+                    self.stop_process(process)
+                    self.start()
+                raise
+
+            except (OSError, ValueError, EOFError, wave.Error) as e:
+                logger.debug("Piper worker request failed: %s", repr(e))
+
+            if self.cancelled.get():
+                self.start()
+                raise WorkerCancelled("Cancelled")
+
+            self.crashes += 1
+            self.stop_process(process)
+            logger.warning(
+                "The piper worker died (exit code %s), restarting it",
+                process.returncode,
+            )
+            if yielded:
+                # Retrying would repeat the audio already handed out
+                self.start()
+                break
+
+        raise WorkerError(f"Piper failed to synthesize {len(text)} characters")
+
+    def synthesize(self, text):
+        return b"".join(self.stream(text))
+
+    def read_utterance(self, process):
+        if self.is_piper_python:
+            while True:
+                header = process.stdout.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    raise EOFError("Truncated frame header")
+                (size,) = FRAME_HEADER.unpack(header)
+                if size == 0:
+                    return
+                frame = process.stdout.read(size)
+                if len(frame) < size:
+                    raise EOFError("Truncated frame")
+                yield frame
+
+        path = process.stdout.readline().decode().strip()
+        if len(path) == 0:
+            raise EOFError("No output path")
+        try:
+            with wave.open(path, "rb") as wav:
+                audio = wav.readframes(wav.getnframes())
+        finally:
+            os.remove(path)
+        yield audio
+
+    def drain(self, reader):
+        # Reads the rest of the utterance, so that the process can take the
+        # next one
+        for _ in reader:
+            pass
+
+    def stop_process(self, process):
+        with self.process.lock:
+            if self.process.data is process:
+                process.kill()
+                process.wait()
+                self.process.data = None
+
+    def status(self):
+        process = self.process.get()
+        return {
+            "pid?": None if process is None else process.pid,
+            "warm": self.warm and process is not None and process.poll() is None,
+            "uses": self.uses,
+            "total_uses": self.total_uses,
+            "restarts": self.restarts,
+            "crashes": self.crashes,
+            "busy": self.request_lock.locked(),
+            "utilization": self.busy_time / (time.monotonic() - self.created_at),
+        }
+
+
+# Synthesizes in the server process with the piper python module, so there's
+# no process, pipe or interpreter between the text and its audio. The voice is
+# loaded once and shared by every worker, onnxruntime sessions being safe to
+# run from several threads at a time
+class PiperModuleWorker:
+    voices = {}
+    voices_lock = threading.Lock()
+
+    def __init__(self, parsed):
+        self.parsed = parsed
+        self.voice = None
+        self.request_lock = threading.Lock()
+        self.cancelled = Locked(False)
+        self.silence = b""
+
+        self.uses = 0
+        self.crashes = 0
+        self.created_at = time.monotonic()
+        self.busy_time = 0.0
+
+    def start(self):
+        key = (self.parsed.piper_model, self.parsed.piper_model_config)
+        with PiperModuleWorker.voices_lock:
+            if key not in PiperModuleWorker.voices:
+                from piper import PiperVoice
+
+                began = time.monotonic()
+                PiperModuleWorker.voices[key] = PiperVoice.load(
+                    self.parsed.piper_model, config_path=self.parsed.piper_model_config
+                )
+                logger.info("Loaded the piper voice in %.2fs", time.monotonic() - began)
+            self.voice = PiperModuleWorker.voices[key]
+            self.silence = silence_for(
+                self.parsed.piper_sentence_silence, self.voice.config.sample_rate
+            )
+
+    def stop(self):
+        self.voice = None
+
+    def cancel(self):
+        # Takes effect at the next sentence boundary
+        if self.request_lock.locked():
+            self.cancelled.set(True)
+
+    def stream(self, text):
+        text = " ".join(text.split())
+        if len(text) == 0:
+            return
+
+        with self.request_lock:
+            self.cancelled.set(False)
+            began = time.monotonic()
+            try:
+                if self.voice is None:
+                    self.start()
+
+                for audio in synthesize_raw(self.voice, text, self.silence):
+                    if self.cancelled.get():
+                        raise WorkerCancelled("Cancelled")
+                    yield audio
+                self.uses += 1
+
+            except Exception as e:
+                if isinstance(e, WorkerError):
+                    raise
+                self.crashes += 1
+                raise WorkerError(
+                    f"Piper failed to synthesize {len(text)} characters: {repr(e)}"
+                )
+
+            finally:
+                self.busy_time += time.monotonic() - began
+
+    def synthesize(self, text):
+        return b"".join(self.stream(text))
+
+    def status(self):
+        return {
+            "in_process": True,
+            "warm": self.voice is not None,
+            "uses": self.uses,
+            "crashes": self.crashes,
+            "busy": self.request_lock.locked(),
+            "utilization": self.busy_time / (time.monotonic() - self.created_at),
+        }
+
+
+def silence_for(seconds, rate):
+    return bytes(int(seconds * rate) * 2)
+
+
+def synthesize_raw(voice, text, silence):
+    # Yields s16le audio per sentence, followed by the silence. piper-tts 1.2
+    # adds the silence itself, later versions don't know about it
+    if hasattr(voice, "synthesize_stream_raw"):
+        yield from voice.synthesize_stream_raw(
+            text, sentence_silence=len(silence) / 2 / voice.config.sample_rate
+        )
+        return
+
+    for chunk in voice.synthesize(text):
+        yield chunk.audio_int16_bytes
+        if len(silence) > 0:
+            yield silence
+
+
+# Driver spawned by PiperWorker when using the piper python module
+def main():
+    parser = argparse.ArgumentParser(prog="piper-worker")
+    parser.add_argument("--model", type=str, required=True)
+    parser.add_argument("--config", type=str, default=None)
+    parser.add_argument("--sentence_silence", type=float, default=0.0)
+    args = parser.parse_args()
+
+    from piper import PiperVoice
+
+    voice = PiperVoice.load(args.model, config_path=args.config)
+    silence = silence_for(args.sentence_silence, voice.config.sample_rate)
+    out = sys.stdout.buffer
+
+    for line in sys.stdin:
+        text = line.strip()
+        if len(text) > 0:
+            for audio in synthesize_raw(voice, text, silence):
+                out.write(FRAME_HEADER.pack(len(audio)))
+                out.write(audio)
+                out.flush()
+        out.write(FRAME_HEADER.pack(0))
+        out.flush()
+
+
+if __name__ == "__main__":
+    main()
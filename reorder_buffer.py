@@ -0,0 +1,67 @@
+import collections
+import threading
+
+
+# Lets several threads produce the audio of consecutive items concurrently
+# while the consumer receives it strictly in item order. Blocks of the item at
+# the head are passed through as soon as they arrive. Items are tuples whose
+# first element is their sequence number
+class ReorderBuffer:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.head = 0
+        self.pending = {}
+        self.size = 0
+
+    def entry(self, item):
+        return self.pending.setdefault(item[0], [item, collections.deque(), False])
+
+    def put(self, item, block):
+        with self.cond:
+            if item[0] < self.head:
+                return
+            self.entry(item)[1].append(block)
+            self.size += len(block)
+            if item[0] == self.head:
+                self.cond.notify_all()
+
+    def finish(self, item):
+        with self.cond:
+            if item[0] < self.head:
+                return
+            self.entry(item)[2] = True
+            if item[0] == self.head:
+                self.cond.notify_all()
+
+    def get(self):
+        # Returns (item, block), with block None once the item is complete
+        with self.cond:
+            while True:
+                entry = self.pending.get(self.head)
+                if entry is not None:
+                    item, blocks, done = entry
+                    if len(blocks) > 0:
+                        block = blocks.popleft()
+                        self.size -= len(block)
+                        return item, block
+                    if done:
+                        del self.pending[self.head]
+                        self.head += 1
+                        return item, None
+                self.cond.wait()
+
+    def skip_to(self, seq):
+        # Forget everything before seq. Late results for those are ignored
+        with self.cond:
+            for stale in [s for s in self.pending if s < seq]:
+                self.size -= sum(len(b) for b in self.pending.pop(stale)[1])
+            self.head = max(self.head, seq)
+            self.cond.notify_all()
+
+    def status(self):
+        with self.cond:
+            return {
+                "head": self.head,
+                "pending": len(self.pending),
+                "size": self.size,
+            }
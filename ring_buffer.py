@@ -0,0 +1,86 @@
+# Fixed storage for audio that's consumed in the order it was written. Every
+# block is kept contiguous, so that it can be handed out as a single
+# memoryview: one that doesn't fit before the end of the buffer goes to its
+# start, and the space left at the end is skipped until the reader gets there.
+# A block that doesn't fit at all is an overrun, the caller keeps it itself.
+# Not thread safe, the owner locks around it
+class RingBuffer:
+    def __init__(self, capacity):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.overruns = 0
+        self.peak = 0
+        self.reset()
+
+    def reset(self):
+        self.head = 0
+        self.tail = 0
+        # Where the data before the start of the buffer ends, once it's wrapped
+        self.limit = len(self.buffer)
+        self.wrapped = False
+        self.used = 0
+
+    def write(self, data):
+        # Copies data in and returns a view of where it is, or None if there
+        # isn't room
+        size = len(data)
+        if self.used == 0:
+            self.reset()
+
+        if self.wrapped:
+            if self.head - self.tail < size:
+                self.overruns += 1
+                return None
+            start = self.tail
+        elif len(self.buffer) - self.tail >= size:
+            start = self.tail
+        elif self.head >= size:
+            self.limit = self.tail
+            self.wrapped = True
+            start = 0
+        else:
+            self.overruns += 1
+            return None
+
+        region = self.view[start : start + size]
+        region[:] = data
+        self.tail = start + size
+        self.used += size
+        self.peak = max(self.peak, self.used)
+        return region
+
+    def owns(self, view):
+        return isinstance(view, memoryview) and view.obj is self.buffer
+
+    def release(self, size):
+        # Frees the oldest size bytes, which the reader is done with
+        size = min(size, self.used)
+        self.head += size
+        self.used -= size
+        if self.used == 0:
+            self.reset()
+        elif self.wrapped and self.head >= self.limit:
+            self.head = 0
+            self.limit = len(self.buffer)
+            self.wrapped = False
+
+    def truncate(self, size):
+        # Drops everything but the oldest size bytes, which have to be the
+        # rest of a single block
+        size = min(size, self.used)
+        if size == 0:
+            self.reset()
+            return
+        self.tail = self.head + size
+        self.used = size
+        self.limit = len(self.buffer)
+        self.wrapped = False
+
+    def status(self):
+        return {
+            "capacity": len(self.buffer),
+            "used": self.used,
+            "occupancy": self.used / len(self.buffer),
+            "peak": self.peak,
+            "overruns": self.overruns,
+        }
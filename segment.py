@@ -0,0 +1,126 @@
+import re
+
+# Sentence ending punctuation followed by whitespace or the end of the text, so
+# that decimals, URLs and e-mail addresses never match, and/or a paragraph
+# break. Single newlines are taken for hard wrapping, except before list items
+PARAGRAPH = r"\n[ \t]*\n\s*|\n(?=[ \t]*(?:[-*•]|\d+[.)])\s)"
+BOUNDARY = re.compile(
+    rf"(?P<end>[.!?…]+[\"'”’)\]]*)(?=\s|\Z)(?P<paragraph>[ \t]*(?:{PARAGRAPH}))?"
+    rf"|{PARAGRAPH}"
+)
+NEXT_CHAR = re.compile(r"\s*(\S)")
+# Where a long sentence is best split, from the most to the least natural
+CLAUSES = (
+    re.compile(r"[;:]\s+"),
+    re.compile(r"\s[—–-]+\s|—"),
+    re.compile(r",\s+"),
+    re.compile(r"\s+"),
+)
+
+# Words whose period doesn't end the sentence even before a capital or a
+# number. Ones like "etc." that often do end it are left to the capital rule
+ABBREVIATIONS = frozenset(
+    """
+    mr mrs ms mx dr prof sr jr st mt ft rev fr hon gen col lt sgt capt cmdr adm
+    gov sen rep pres supt insp messrs mme mlle
+    vs cf eg ie viz approx ca
+    no nos vol vols ch chap sec fig figs eq eqs pp pg art ref op
+    jan feb mar apr jun jul aug sep sept oct nov dec
+    """.split()
+)
+
+MIN_CHARS = 24
+MAX_CHARS = 300
+
+
+def split_sentences(text, min_chars=MIN_CHARS, max_chars=MAX_CHARS):
+    # Splits text into the chunks it's synthesized in. Fragments shorter than
+    # min_chars are merged into the next sentence of the same paragraph and
+    # only sentences longer than max_chars are split, at clause boundaries.
+    # Piper pauses after every chunk, and a sentence is chunked the same
+    # wherever it is in the text so that its audio is found in the cache when
+    # it's read again as part of another selection. Runs in linear time
+    chunks = []
+    pending = None
+    for sentence, paragraph_end in sentences(text):
+        if pending is not None:
+            sentence = pending + " " + sentence
+            pending = None
+
+        if len(sentence) < min_chars and not paragraph_end:
+            pending = sentence
+            continue
+
+        chunks.extend(split_long(sentence, max_chars))
+
+    if pending is not None:
+        if len(chunks) > 0 and len(chunks[-1]) + len(pending) < max_chars:
+            chunks[-1] = chunks[-1] + " " + pending
+        else:
+            chunks.append(pending)
+    return chunks
+
+
+def sentences(text):
+    # Yields (sentence, whether a paragraph ends after it) with whitespace
+    # collapsed
+    start = 0
+    for match in BOUNDARY.finditer(text):
+        end = match.end()
+        paragraph_end = (
+            match.group("end") is None or match.group("paragraph") is not None
+        )
+        if not paragraph_end and not ends_sentence(text, match):
+            continue
+
+        sentence = " ".join(text[start:end].split())
+        start = end
+        if len(sentence) > 0:
+            yield sentence, paragraph_end
+
+    sentence = " ".join(text[start:].split())
+    if len(sentence) > 0:
+        yield sentence, True
+
+
+def ends_sentence(text, match):
+    punctuation = match.group("end").rstrip("\"'”’)]")
+    if punctuation == ".":
+        # Only look back as far as an abbreviation can be long
+        word = text[max(0, match.start() - 16) : match.start()].split()
+        word = word[-1] if len(word) > 0 else ""
+        word = word.lstrip("\"'“‘([").replace(".", "").lower()
+        if word in ABBREVIATIONS:
+            return False
+        # An initial, as in "J. R. R. Tolkien"
+        if len(word) == 1 and word.isalpha():
+            return False
+
+    # "e.g. this", "... and then", "etc. which" carry on the same sentence
+    following = NEXT_CHAR.match(text, match.end())
+    return following is None or not following.group(1).islower()
+
+
+def split_long(sentence, limit):
+    # Cuts sentence into pieces of at most limit characters, at the latest of
+    # the most natural boundaries that's not in the first third of a piece
+    pieces = []
+    start = 0
+    while len(sentence) - start > limit:
+        end = start + limit
+        cut = None
+        for clause in CLAUSES:
+            for match in clause.finditer(sentence, start + limit // 3, end):
+                cut = match
+            if cut is not None:
+                break
+
+        if cut is None:
+            pieces.append(sentence[start:end])
+            start = end
+        else:
+            pieces.append(sentence[start : cut.start() + 1].strip())
+            start = cut.end()
+
+    pieces.append(sentence[start:].strip())
+    return [piece for piece in pieces if len(piece) > 0]
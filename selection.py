@@ -0,0 +1,130 @@
+import logging
+import os
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds get() waits for a selection that's just changed to be fetched
+FETCH_TIMEOUT = 0.5
+# Seconds before a watcher that failed is started again
+RESTART_DELAY = 5
+
+
+# Keeps the latest primary selection in memory so that /read doesn't have to
+# spawn a process to get it. With a watch command, which prints a line every
+# time the selection changes, the selection is fetched on every change.
+# Otherwise it's polled every interval seconds
+class SelectionWatcher:
+    def __init__(
+        self, paste_command, watch_command=None, interval=0.25, on_change=None
+    ):
+        self.paste_command = paste_command
+        self.watch_command = watch_command
+        self.interval = interval
+        self.on_change = on_change
+
+        self.lock = threading.Lock()
+        self.selection = None
+        # Cleared while a change is being fetched
+        self.fetched = threading.Event()
+        self.fetched.set()
+
+        self.fetches = 0
+        self.changes = 0
+        self.failures = 0
+        self.restarts = 0
+        self.fetch_seconds = None
+        self.updated = None
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def get(self):
+        # The contents of the selection, or None if they aren't known, in
+        # which case the caller has to fetch them itself
+        if not self.fetched.wait(FETCH_TIMEOUT):
+            return None
+        with self.lock:
+            return self.selection
+
+    def run(self):
+        while True:
+            try:
+                if self.watch_command is None:
+                    self.poll()
+                else:
+                    self.watch()
+            except OSError as e:
+                logger.error("Failed to run the selection watcher: %s", repr(e))
+
+            with self.lock:
+                self.selection = None
+                self.restarts += 1
+            self.fetched.set()
+            time.sleep(RESTART_DELAY)
+
+    def poll(self):
+        while True:
+            self.fetch()
+            time.sleep(self.interval)
+
+    def watch(self):
+        with subprocess.Popen(
+            self.watch_command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=0,
+        ) as process:
+            fd = process.stdout.fileno()
+            self.fetch()
+            # A read returns all the lines printed since the last one, so a
+            # burst of changes is fetched once
+            while len(os.read(fd, 4096)) > 0:
+                self.fetched.clear()
+                self.fetch()
+        logger.error("The selection watcher exited with %s", process.returncode)
+
+    def fetch(self):
+        started = time.monotonic()
+        try:
+            out = subprocess.run(
+                self.paste_command,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            ).stdout
+        except subprocess.CalledProcessError:
+            # Most likely an empty selection, which /read reports itself
+            out = None
+
+        with self.lock:
+            changed = out is not None and out != self.selection
+            self.selection = out
+            self.fetches += 1
+            self.fetch_seconds = time.monotonic() - started
+            if out is None:
+                self.failures += 1
+            if changed:
+                self.changes += 1
+                self.updated = time.time()
+        self.fetched.set()
+
+        if changed and self.on_change is not None:
+            self.on_change(out)
+
+    def status(self):
+        with self.lock:
+            return {
+                "mode": "poll" if self.watch_command is None else "watch",
+                "fetches": self.fetches,
+                "changes": self.changes,
+                "failures": self.failures,
+                "restarts": self.restarts,
+                "fetch_seconds": self.fetch_seconds,
+                "age": None if self.updated is None else time.time() - self.updated,
+                "thread.is_alive()": self.thread.is_alive(),
+            }
@@ -31,11 +31,15 @@ class Speechd(TTS):
 
         self.inited = True
 
-    def speak(self, text, getaudio):
+    def speak(self, text, getaudio, mode="enqueue", started=None):
         if getaudio:
-            e = "The speech dispatcher backend doesn't support downloading audio!"
-            logger.error(e)
-            return e
+            logger.error("The speech dispatcher backend doesn't support downloading audio!")
+            return None
+
+        if mode == "interrupt":
+            self.reset()
+        elif mode == "next":
+            logger.error("The speech dispatcher backend can't resume after reading next. Enqueuing")
 
         self.play()
 
@@ -81,3 +85,7 @@ class Speechd(TTS):
         return {
             "paused": self.paused,
         }
+
+    def shutdown(self):
+        if self.inited:
+            self.sdclient.close()
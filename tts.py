@@ -1,4 +1,10 @@
 from abc import ABC, abstractmethod
+import asyncio
+
+# How /read's text is queued for playback: after everything else, instead of
+# everything else, or before everything else, which then carries on where it
+# was interrupted
+MODES = ("enqueue", "interrupt", "next")
 
 
 class TTS(ABC):
@@ -9,8 +15,44 @@ class TTS(ABC):
     def __del__(self):
         pass
 
+    # started is the time.monotonic() the request came in at
     @abstractmethod
-    def speak(self, text, getaudio):
+    def speak(self, text, getaudio, mode="enqueue", started=None):
+        pass
+
+    # Backends which queue jobs return their id from speak() and override these
+    def job_status(self, job_id):
+        return None
+
+    def job_audio(self, job_id):
+        return None
+
+    # The async interface, for event loops. The other methods return right
+    # away and can be called from a loop as they are
+    async def aspeak(self, text, getaudio, mode="enqueue", started=None):
+        return await asyncio.to_thread(self.speak, text, getaudio, mode, started)
+
+    def ajob_audio(self, job_id):
+        # The audio of job_audio() as an async iterator. Backends which can
+        # wait for it without a thread override this
+        audio = self.job_audio(job_id)
+        if audio is None:
+            return None
+        return iterate_in_thread(audio)
+
+    # Backends which can synthesize ahead of a likely /read of text override
+    # this
+    def prefetch(self, text):
+        pass
+
+    # Backends which keep track of where they are in the text override these
+    def seek(self, seconds):
+        pass
+
+    def back(self):
+        pass
+
+    def next(self):
         pass
 
     @abstractmethod
@@ -36,3 +78,21 @@ class TTS(ABC):
     @abstractmethod
     def status(self):
         pass
+
+    # Stops whatever processes the backend runs, for when the server exits
+    def shutdown(self):
+        pass
+
+
+async def iterate_in_thread(iterator):
+    done = object()
+    try:
+        while True:
+            item = await asyncio.to_thread(next, iterator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()